@@ -0,0 +1,75 @@
+# cython: language_level=2, boundscheck=False, wraparound=False
+
+"""Compiled graph traversal for lusmu.core and lusmu.visualization
+
+This optional extension module is built by ``setup.py`` if Cython is
+installed.  ``lusmu.core`` and ``lusmu.visualization`` fall back to their pure
+Python implementations if the module isn't available.
+
+Copyright 2013 Eniram Ltd. See the LICENSE file at the top-level directory of
+this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
+
+"""
+
+
+def fill_triggered_cache(nodes, version):
+    """Cache triggered dependents of given Nodes and all their dependents
+
+    See ``lusmu.core._fill_triggered_cache()`` for the equivalent pure Python
+    implementation.
+
+    """
+    cdef list stack = [(node, False) for node in nodes
+                       if node._has_triggered_descendant
+                       and node._triggered_cache[0] != version]
+    cdef list dependents
+    cdef set triggered
+    cdef bint dependents_done
+    cdef int height
+    while stack:
+        node, dependents_done = stack.pop()
+        if node._triggered_cache[0] == version:
+            continue
+        if not dependents_done:
+            stack.append((node, True))
+            for dependent in node._dependents:
+                if ((dependent._has_triggered_descendant
+                     and dependent._triggered_cache[0] != version)):
+                    stack.append((dependent, False))
+            continue
+        dependents = list(node._dependents)
+        height = -1
+        for dependent in dependents:
+            if dependent._triggered or dependent._has_triggered_descendant:
+                height = max(height, dependent._triggered_cache[2])
+        height += 1
+        if len(dependents) == 1 and not dependents[0]._triggered:
+            # share the frozenset of the only dependent instead of copying it
+            node._triggered_cache = (version,
+                                     dependents[0]._triggered_cache[1],
+                                     height)
+            continue
+        triggered = set()
+        for dependent in dependents:
+            if dependent._triggered:
+                triggered.add(dependent)
+            triggered.update(dependent._triggered_cache[1])
+        node._triggered_cache = version, frozenset(triggered), height
+
+
+def collect_nodes(collected_nodes, *args):
+    """Collect all nodes belonging to the same graph
+
+    See ``lusmu.visualization.collect_nodes()`` for the equivalent pure Python
+    implementation.  Inputs have an empty ``_inputs`` tuple, so the inputs of
+    all nodes can be walked without checking their type.
+
+    """
+    cdef list stack = list(args)
+    while stack:
+        node = stack.pop()
+        if node in collected_nodes:
+            continue
+        collected_nodes.add(node)
+        stack.extend(node._dependents)
+        stack.extend(node._inputs)
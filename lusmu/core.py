@@ -11,16 +11,21 @@ this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
 #         Allow * and ** magic
 
 from collections import defaultdict
-from functools import total_ordering
+from contextlib import contextmanager
+from functools import reduce, total_ordering
 import itertools
+import keyword
 import logging
+import re
 import sys
+import weakref
 
 
 LOG = logging.getLogger('lusmu.base')
 
 # When developing, change this to True in order to verify the type consistency
-# of Lusmu graphs.
+# of Lusmu graphs.  To switch verification on or off for Nodes which have
+# already been evaluated, use ``set_verify_output_types()``.
 VERIFY_OUTPUT_TYPES = False
 
 
@@ -36,6 +41,10 @@ if sys.version_info[0] == 2:
     def get_func_name(function, default=None):
         """Return the name of the function, falling back to a default"""
         return getattr(function, 'func_name', default)
+
+    def intern_name(name):
+        """Intern a byte string name, leave other objects untouched"""
+        return intern(name) if type(name) is str else name
 else:
     def items(dictionary):
         """Return a set-like object, a view on key/value pairs of a dict"""
@@ -49,8 +58,41 @@ else:
         """Return the name of the function, falling back to a default"""
         return getattr(function, '__name__', default)
 
+    def intern_name(name):
+        """Intern a string name, leave other objects untouched"""
+        return sys.intern(name) if type(name) is str else name
+
+
+# The graph version is bumped whenever Nodes are connected or disconnected,
+# or when they're set triggered or untriggered.  The triggered dependents
+# cached on each Node are only valid for the graph version they were computed
+# for.
+_GRAPH_VERSION = [0]
+
+# The render version is bumped whenever Nodes are connected, disconnected or
+# renamed.  The cached Graphviz source in ``lusmu.visualization`` is only
+# valid for the render version it was rendered for.
+_RENDER_VERSION = [0]
+
+# Input updates queued inside ``lazy_updates()`` blocks, and the nesting depth
+# of those blocks
+_PENDING_UPDATES = []
+_LAZY_UPDATES = [0]
 
-_TRIGGERED_CACHE = {}
+# Shared by all Nodes and Inputs without dependents, so leaf Nodes don't need
+# a list of their own.  A list is created when the first dependent connects.
+_NO_DEPENDENTS = ()
+
+# Nodes and Inputs with at least this many dependents keep a set of their
+# ids, so connecting a wide fan-out of dependents doesn't scan the list of
+# dependents for each of them
+_DEPENDENT_IDS_MIN_COUNT = 8
+
+# Sequence numbers for Nodes and Inputs in creation order
+_SEQ_IDS = itertools.count()
+
+# Nodes which have resolved and cached their output type check
+_TYPE_CHECKED_NODES = weakref.WeakSet()
 
 
 class _DIRTY(object):
@@ -72,12 +114,80 @@ DIRTY = _DIRTY()
 class BaseNode(object):
     """Base class for Inputs and Nodes"""
 
-    _name_counters = defaultdict(int)
+    # Graphs can have lots of Nodes, so attributes are stored in slots
+    # instead of a ``__dict__`` for each instance
+    __slots__ = ('_name',
+                 '_value',
+                 '_dependents',
+                 '_dependent_ids',
+                 '_triggered_cache',
+                 '_triggered_order',
+                 '_value_version',
+                 '_has_triggered_descendant',
+                 '_seq_id',
+                 '__weakref__')
+
+    # Inputs don't have inputs of their own.  Nodes override this.
+    _inputs = ()
 
     def __init__(self, name=None, value=DIRTY):
-        self.name = name or self._generate_name()
+        self._name = intern_name(name)
         self._value = value
-        self._dependents = set()
+        self._dependents = _NO_DEPENDENTS
+        # True if any Node in the dependent chain is triggered.  Set when such
+        # a chain is connected, and never cleared, so a stale True only costs
+        # a walk.  Walks for triggered dependents are skipped if this is False.
+        self._has_triggered_descendant = False
+        self._init_state()
+
+    def _init_state(self):
+        """Set the initial values of attributes cached on the object
+
+        Called by the constructor, and when unpickling objects whose pickled
+        state doesn't include these attributes.
+
+        """
+        # The graph version, the frozenset of triggered dependents and the
+        # length of the longest chain to a triggered dependent last computed
+        # for this Node or Input.  Keeping the cache on the objects themselves
+        # means it doesn't keep garbage nodes alive.
+        self._triggered_cache = (None, frozenset(), 0)
+        # The graph version, the frozenset of Inputs and Nodes changed
+        # together with this one and their triggered dependents in evaluation
+        # order, last computed by ``update_inputs_iter()``
+        self._triggered_order = (None, None, ())
+        # The set of ids of dependents, created from the list of dependents
+        # when it has grown long enough.  See ``_has_dependent()``.
+        self._dependent_ids = None
+        # Increasing number for sorting Nodes and Inputs in creation order.
+        # Unpickled objects are numbered in the order they're unpickled.
+        self._seq_id = next(_SEQ_IDS)
+        # Incremented whenever a new non-DIRTY value is set or calculated.
+        # Used by Nodes with pure actions to tell whether their inputs have
+        # changed.
+        self._value_version = 0
+
+    @property
+    def name(self):
+        """The name of this Node or Input
+
+        If no name was given, a unique name is generated when it's first
+        needed.  This way no names are generated for large graphs whose
+        names aren't used for debugging.  Names are interned, so equal names
+        share one string object.
+
+        Renaming bumps the render version, since cached visualizations of
+        the graph show the names of its nodes.
+
+        """
+        if not self._name:
+            self._name = intern_name(self._generate_name())
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = intern_name(name)
+        _RENDER_VERSION[0] += 1
 
     def _connect(self, dependent):
         """Set the given Node as a dependent of this Node or Input
@@ -86,14 +196,53 @@ class BaseNode(object):
         already been evaluated or if a value has already been set for this
         Input.
 
-        Connecting Nodes always invalidates the triggered Nodes cache.
+        Connecting Nodes always invalidates the triggered Nodes cache by
+        bumping the graph version.
+
+        """
+        if self._has_dependent(dependent):
+            return
+        if self._dependents is _NO_DEPENDENTS:
+            self._dependents = [dependent]
+        else:
+            self._dependents.append(dependent)
+        if self._dependent_ids is not None:
+            self._dependent_ids.add(id(dependent))
+        if self._value is not DIRTY:
+            dependent._set_value(DIRTY, get_triggered=False)
+        if dependent._triggered or dependent._has_triggered_descendant:
+            self._set_has_triggered_descendant()
+        _GRAPH_VERSION[0] += 1
+        _RENDER_VERSION[0] += 1
+
+    def _has_dependent(self, dependent):
+        """Return True if the given Node is a dependent of this Node or Input
+
+        Identities are compared, since subclasses may define value-based
+        ``__eq__``.  Short lists of dependents are scanned.  For longer ones,
+        a set of dependent ids is created on first use and kept up to date
+        when connecting and disconnecting.
 
         """
-        if dependent not in self._dependents:
-            self._dependents.add(dependent)
-            if self._value is not DIRTY:
-                dependent._set_value(DIRTY, get_triggered=False)
-            _TRIGGERED_CACHE.clear()
+        dependents = self._dependents
+        if len(dependents) < _DEPENDENT_IDS_MIN_COUNT:
+            for existing in dependents:
+                if existing is dependent:
+                    return True
+            return False
+        if self._dependent_ids is None:
+            self._dependent_ids = set(id(existing) for existing in dependents)
+        return id(dependent) in self._dependent_ids
+
+    def _set_has_triggered_descendant(self):
+        """Flag this Node or Input and its ancestors as having a triggered
+        descendant"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not node._has_triggered_descendant:
+                node._has_triggered_descendant = True
+                stack.extend(node._inputs)
 
     def _disconnect(self, dependent):
         """Remove given Node from the set of dependents of this Node or Input
@@ -102,45 +251,70 @@ class BaseNode(object):
         previously been evaluated or if a value has previously been set for
         this Input.
 
-        Disconnecting Nodes always invalidates the triggered nodes cache.
+        Disconnecting Nodes always invalidates the triggered nodes cache by
+        bumping the graph version.
 
         """
-        if dependent in self._dependents:
-            self._dependents.remove(dependent)
-            if self._value is not DIRTY:
-                dependent._set_value(DIRTY, get_triggered=False)
-            _TRIGGERED_CACHE.clear()
-
-    def _set_value(self, value, get_triggered=True):
+        if not self._has_dependent(dependent):
+            return
+        for index, existing in enumerate(self._dependents):
+            if existing is dependent:
+                del self._dependents[index]
+                if self._dependent_ids is not None:
+                    self._dependent_ids.discard(id(dependent))
+                if self._value is not DIRTY:
+                    dependent._set_value(DIRTY, get_triggered=False)
+                _GRAPH_VERSION[0] += 1
+                _RENDER_VERSION[0] += 1
+                return
+
+    def _set_value(self, value, get_triggered=True, compare=True):
         """Set a new value for this Node or Input
 
         If this caused the value to change, paints dependent Nodes dirty and
         returns the set of those dependent Nodes which are marked "triggered"
         and should be re-evaluated.
 
+        With ``compare=False``, the value isn't compared to the current value
+        but is always considered changed.  This saves a comparison of large
+        vectors when the caller knows each value is new anyway.
+
         When called by ``set_value`` from external code, the ``get_triggered``
-        argument must be ``True`` so the return value is cached.  Internal
-        calls set ``get_triggered=False`` so memory isn't wasted for caching the
-        triggered dependents of intermediate Nodes.
+        argument must be ``True`` so the triggered dependents are returned.
+        Internal calls set ``get_triggered=False`` when they don't need the
+        triggered dependents.  In that case a boolean telling whether the
+        value changed is returned instead.
 
         This private method can be used as a debugging tool to set values of
         non-input Nodes.
 
         """
-        # test if neither, one of or both the old and the new value are DIRTY
-        dirty_count = len([v for v in value, self._value if v is DIRTY])
-        if dirty_count == 2:
-            # both DIRTY, no need to touch anything
-            return set()
-        if dirty_count == 0 and self._value_eq(value):
-            # both non-DIRTY but equal, no need to touch anything
-            return set()
-        # either one is DIRTY, or values aren't equal, update the value and
-        # paint the dependent Nodes dirty
+        if compare and not self._is_new_value(value):
+            # no need to touch anything
+            return frozenset() if get_triggered else False
+        # update the value and paint the dependent Nodes dirty
         self._value = value
+        if value is not DIRTY:
+            self._value_version += 1
         self._set_dependents_dirty()
         if get_triggered:
             return self._get_triggered_dependents()
+        return True
+
+    def _is_new_value(self, value):
+        """Return True if the given value differs from the current value"""
+        if value is self._value:
+            # the very same object, or both DIRTY
+            return False
+        # test if neither, one of or both the old and the new value are DIRTY
+        dirty_count = len([v for v in value, self._value if v is DIRTY])
+        if dirty_count == 2:
+            return False
+        if dirty_count == 0 and self._value_eq(value):
+            # both non-DIRTY but equal
+            return False
+        # either one is DIRTY, or values aren't equal
+        return True
 
     def _value_eq(self, other_value):
         return self._value == other_value
@@ -150,27 +324,24 @@ class BaseNode(object):
         raise NotImplementedError('The get_value() method must be defined '
                                   'for subclasses of BaseNode')
 
-    def _get_triggered_dependents(self, make_cache=True):
+    def _get_triggered_dependents(self):
         """Return the set of triggered dependent Nodes
 
         The set includes Nodes which are marked as triggered and are included
-        in the dependent chain from this Node or Input.
+        in the dependent chain from this Node or Input.  It is returned as a
+        frozenset since it's shared with the cache.
 
-        The result is cached for the Node or Input if ``make_cache == True``,
-        but caching is suppressed for recursively walked dependent Nodes.  This
-        way we only use cache memory only for Nodes and Inputs whose triggered
-        dependents are queried from external code.
+        The result is cached for this and all dependent Nodes.  See
+        ``_fill_triggered_cache()``.  Nodes and Inputs without triggered
+        descendants don't need to walk their dependents at all.
 
         """
-        if self in _TRIGGERED_CACHE:
-            return _TRIGGERED_CACHE[self]
-        triggered = set()
-        for dependent in self._dependents:
-            if dependent.triggered:
-                triggered.add(dependent)
-            triggered |= dependent._get_triggered_dependents(make_cache=False)
-        if make_cache:
-            _TRIGGERED_CACHE[self] = triggered
+        if not self._has_triggered_descendant:
+            return frozenset()
+        version, triggered, _height = self._triggered_cache
+        if version != _GRAPH_VERSION[0]:
+            _fill_triggered_cache([self], _GRAPH_VERSION[0])
+            triggered = self._triggered_cache[1]
         return triggered
 
     def _set_dependents_dirty(self):
@@ -191,12 +362,18 @@ class BaseNode(object):
         * the name of the class
         * an auto-incremented number
 
+        Each class has its own counter.  Python 2 has no
+        ``__init_subclass__``, so the counter is attached to the class when
+        the first instance without an explicit name is created.
+
         """
-        counters = self._name_counters
+        cls = self.__class__
+        counter = cls.__dict__.get('_name_counter')
+        if counter is None:
+            counter = cls._name_counter = itertools.count(1)
         template = '{class_name}-{counter}'
-        counters[self.__class__] += 1
-        return template.format(class_name=self.__class__.__name__,
-                               counter=counters[self.__class__])
+        return template.format(class_name=cls.__name__,
+                               counter=next(counter))
 
     def __unicode__(self):
         return unicode(self.get_value())
@@ -228,8 +405,12 @@ class Input(BaseNode):
         >>> sensor = Input(name='sensor', value=-5.3)  # named, with default
 
     """
+    __slots__ = ()
+
     def get_value(self):
         """Return the value of the Input"""
+        if _PENDING_UPDATES:
+            _flush_pending_updates()
         return self._value
 
     def set_value(self, new_value):
@@ -239,12 +420,78 @@ class Input(BaseNode):
         returns the set of those dependent Nodes which are marked "triggered"
         and should be re-evaluated.
 
+        Inside a ``lazy_updates()`` block the update is only queued, and an
+        empty set is returned.
+
         """
+        if _LAZY_UPDATES[0]:
+            _PENDING_UPDATES.append((self, new_value))
+            return frozenset()
         return self._set_value(new_value, get_triggered=True)
 
     value = property(get_value, set_value)
 
 
+# Functions for calling actions, keyed by the number of positional inputs and
+# the tuple of keyword input names
+_ACTION_CALLERS = {}
+
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+# Python 2 doesn't allow more arguments than this in a call expression
+_MAX_ARGUMENTS = 255
+
+
+def _get_action_caller(positional_count, keyword_names):
+    """Return a function which calls an action with values of inputs
+
+    The returned function takes the action and the flat tuple of inputs of a
+    Node.  For Nodes with one positional and one keyword input named ``x``,
+    the generated function is::
+
+        def call_action(action, inputs):
+            return action(inputs[0].get_value(), x=inputs[1].get_value())
+
+    This avoids building argument lists and keyword dictionaries on each
+    evaluation.  Functions are generated once for each shape of inputs and
+    shared by all Nodes of that shape.  A generic function is used for
+    keyword names which aren't identifiers and for very many inputs.
+
+    """
+    key = positional_count, keyword_names
+    caller = _ACTION_CALLERS.get(key)
+    if caller is not None:
+        return caller
+    if ((positional_count + len(keyword_names) > _MAX_ARGUMENTS
+         or not all(_IDENTIFIER_RE.match(name)
+                    and not keyword.iskeyword(name)
+                    for name in keyword_names))):
+        def call_action(action, inputs):
+            """Call an action with values of inputs of any shape"""
+            input_values = [i.get_value() for i in inputs]
+            return action(*input_values[:positional_count],
+                          **dict(zip(keyword_names,
+                                     input_values[positional_count:])))
+        caller = call_action
+    else:
+        arguments = ['inputs[{}].get_value()'.format(index)
+                     for index in range(positional_count)]
+        arguments.extend('{}=inputs[{}].get_value()'
+                         .format(name, positional_count + index)
+                         for index, name in enumerate(keyword_names))
+        source = ('def call_action(action, inputs):\n'
+                  '    return action({})\n'.format(', '.join(arguments)))
+        namespace = {}
+        exec(source, namespace)
+        caller = namespace['call_action']
+    _ACTION_CALLERS[key] = caller
+    return caller
+
+
+def _skip_output_type_check(value):
+    """Accept any output value when output type verification is disabled"""
+
+
 @total_ordering
 class Node(BaseNode):
     """The Node class for reactive programming
@@ -259,7 +506,9 @@ class Node(BaseNode):
     action: callable(*positional_inputs, **keyword_inputs)
             The function for calculating the value of a calculated node.
             Values from inputs are provided in positional and keyword arguments
-            as defined in the ``inputs=`` argument.
+            as defined in the ``inputs=`` argument.  If the action has a
+            true ``pure`` attribute, it's assumed to have no side effects,
+            and it's only called again if input values have changed.
 
     inputs (optional): ((Input/Node, ...), {key: Input/Node, ...})
             The Nodes and Inputs whose values are used as inputs for the
@@ -283,19 +532,59 @@ class Node(BaseNode):
         ...     triggered=True)
 
     """
+    __slots__ = ('_action',
+                 '_triggered',
+                 '_inputs',
+                 '_keyword_names',
+                 '_pure_cache',
+                 '_action_caller',
+                 '_output_type_check')
+
     def __init__(self,
                  name=None,
                  action=None,
                  inputs=((), None),
                  triggered=False):
-        self._action = action  # must be set before generating name
+        self._action = action
         super(Node, self).__init__(name, value=DIRTY)
-        self.triggered = triggered
-        self._positional_inputs = ()
-        self._keyword_inputs = {}
+        # connecting to inputs flags them as having a triggered descendant
+        self._triggered = triggered
+        # All inputs are stored in one flat tuple: positional inputs first,
+        # followed by keyword inputs in the order of ``_keyword_names``
+        self._inputs = ()
+        self._keyword_names = ()
         self.set_inputs(*inputs[0], **inputs[1] or {})
         self._set_dependents_dirty()
 
+    def _init_state(self):
+        """Set the initial values of attributes cached on the Node"""
+        super(Node, self)._init_state()
+        # The inputs tuple, their value versions and the value of the
+        # previous evaluation of a Node with a pure action
+        self._pure_cache = (None, None, DIRTY)
+        # Resolved on first evaluation, see ``_evaluate()``
+        self._action_caller = None
+        self._output_type_check = None
+
+    @property
+    def triggered(self):
+        """``True`` if this Node is evaluated automatically on input changes
+
+        Setting this flags the inputs and their ancestors as having a
+        triggered descendant and bumps the graph version, so the triggered
+        Nodes cache is refreshed.
+
+        """
+        return self._triggered
+
+    @triggered.setter
+    def triggered(self, triggered):
+        self._triggered = triggered
+        if triggered:
+            for inp in self._inputs:
+                inp._set_has_triggered_descendant()
+        _GRAPH_VERSION[0] += 1
+
     def _evaluate(self):
         """Calculate the value for the Node
 
@@ -309,18 +598,85 @@ class Node(BaseNode):
         if not self._action:
             raise NotImplementedError('You must define the action= argument '
                                       'when instantiating the Node')
-        positional_values = [i.get_value()
-                             for i in self._positional_inputs]
-        keyword_values = {name: i.get_value()
-                          for name, i in items(self._keyword_inputs)}
-        value = self._action(*positional_values, **keyword_values)
+        caller = self._action_caller or self._resolve_action_caller()
+        value = caller(self._action, self._inputs)
+        check = self._output_type_check or self._resolve_output_type_check()
+        check(value)
+        return value
+
+    def _evaluate_pure(self):
+        """Calculate the value for a Node whose action has no side effects
+
+        Actions with a true ``pure`` attribute are only called if the inputs
+        or their value versions have changed since the previous evaluation.
+        Otherwise the previously calculated value is returned.  The value
+        version of the Node is only incremented if the calculated value
+        differs from the previous one, so unchanged results don't cause pure
+        dependents to be re-calculated either.
+
+        """
+        inputs = self._inputs
+        for node in inputs:
+            node.get_value()
+        versions = tuple(node._value_version for node in inputs)
+        cached_inputs, cached_versions, cached_value = self._pure_cache
+        if cached_inputs is inputs and cached_versions == versions:
+            return cached_value
+        value = self._evaluate()
+        # compare to the previous value with the Node's own equality rules
+        self._value = cached_value
+        if self._is_new_value(value):
+            self._value_version += 1
+        self._pure_cache = inputs, versions, value
+        return value
+
+    def _resolve_action_caller(self):
+        """Return the function for calling the action with input values
+
+        On the first evaluation after the inputs have been set, looks up a
+        function specialized for the number of positional inputs and the
+        keyword input names of this Node and caches it on the instance.  See
+        ``_get_action_caller()``.
+
+        """
+        positional_count = len(self._inputs) - len(self._keyword_names)
+        caller = _get_action_caller(positional_count, self._keyword_names)
+        self._action_caller = caller
+        return caller
+
+    def _reset_action_caller(self):
+        """Forget the action caller after the shape of inputs has changed"""
+        self._action_caller = None
+
+    def _resolve_output_type_check(self):
+        """Return the function for checking the output type of the action
+
+        The kind of check is resolved on the first evaluation of the Node and
+        cached on the instance, so later evaluations make one call instead of
+        looking up the global flag and the action's output type.
+        ``set_verify_output_types()`` clears the cached checks.
+
+        """
         if ((VERIFY_OUTPUT_TYPES
              and getattr(self._action, 'output_type', None) is not None)):
             # Output type checking has been enabled, and the node's action
             # does specify the expected output type. Check that the calculated
             # value matches that type.
-            self._verify_output_type(value)
-        return value
+            check = self._make_output_type_check()
+        else:
+            check = _skip_output_type_check
+        self._output_type_check = check
+        _TYPE_CHECKED_NODES.add(self)
+        return check
+
+    def _make_output_type_check(self):
+        """Return the function for verifying output types of the action
+
+        Subclasses may return a function specialized for the action's output
+        type.
+
+        """
+        return self._verify_output_type
 
     @staticmethod
     def inputs(*args, **kwargs):
@@ -340,6 +696,32 @@ class Node(BaseNode):
         """
         return args, kwargs
 
+    @staticmethod
+    def reducer(function):
+        """Construct an action which reduces positional inputs with a function
+
+        The returned action calls the two-argument ``function`` directly for
+        two inputs and falls back to ``reduce()`` for other numbers of inputs,
+        so for example summing two values skips the iteration done by
+        ``sum()``::
+
+            >>> import operator
+            >>> total = Node(action=Node.reducer(operator.add),
+            ...              inputs=Node.inputs(Input(value=1),
+            ...                                 Input(value=2)))
+            >>> total.value
+            3
+
+        """
+        def action(*args):
+            if len(args) == 2:
+                return function(*args)
+            return reduce(function, args)
+        # built-in functions have no ``func_name`` in Python 2
+        action.__name__ = 'reduce_{}'.format(
+            getattr(function, '__name__', 'function'))
+        return action
+
     def _verify_output_type(self, value):
         """Assert that the given value matches the action's output type
 
@@ -360,26 +742,71 @@ class Node(BaseNode):
 
         """
         if not isinstance(value, self._action.output_type):
-            raise TypeError(
-                "The output value type {value_type!r} for [{self.name}]\n"
-                "doesn't match the expected type "
-                '{self._action.output_type.__name__!r} for action '
-                '"{self._action.name}".'
-                .format(value_type=type(value).__name__, self=self))
+            raise self._output_type_error(type(value).__name__)
+
+    def _output_type_error(self, value_type_name):
+        """Return the exception for an output value of the wrong type
+
+        The error message is only formatted once a type check has failed.
+
+        """
+        return TypeError(
+            "The output value type {value_type!r} for [{self.name}]\n"
+            "doesn't match the expected type "
+            '{self._action.output_type.__name__!r} for action '
+            '"{self._action.name}".'
+            .format(value_type=value_type_name, self=self))
 
     def set_inputs(self, *args, **kwargs):
         """Replace current positional and keyword inputs"""
-        for inp in self._iterate_inputs():
+        for inp in self._inputs:
             inp._disconnect(self)
-        self._positional_inputs = args
-        self._keyword_inputs = kwargs
-        for inp in self._iterate_inputs():
+        self._keyword_names = tuple(kwargs)
+        self._inputs = args + tuple(kwargs[name]
+                                    for name in self._keyword_names)
+        self._reset_action_caller()
+        for inp in self._inputs:
             inp._connect(self)
 
+    def _get_positional_inputs(self):
+        """Return the positional inputs as a tuple"""
+        return self._inputs[:len(self._inputs) - len(self._keyword_names)]
+
+    def _set_positional_inputs(self, positional_inputs):
+        """Replace positional inputs without connecting or disconnecting"""
+        keyword_inputs = self._inputs[len(self._inputs)
+                                      - len(self._keyword_names):]
+        self._inputs = tuple(positional_inputs) + keyword_inputs
+        self._reset_action_caller()
+
+    _positional_inputs = property(_get_positional_inputs,
+                                  _set_positional_inputs)
+
+    def _get_keyword_inputs(self):
+        """Return the keyword inputs as a dictionary"""
+        split = len(self._inputs) - len(self._keyword_names)
+        return dict(zip(self._keyword_names, self._inputs[split:]))
+
+    def _set_keyword_inputs(self, keyword_inputs):
+        """Replace keyword inputs without connecting or disconnecting"""
+        positional_inputs = self._get_positional_inputs()
+        self._keyword_names = tuple(keyword_inputs)
+        self._inputs = positional_inputs + tuple(
+            keyword_inputs[name] for name in self._keyword_names)
+        self._reset_action_caller()
+
+    _keyword_inputs = property(_get_keyword_inputs, _set_keyword_inputs)
+
     def get_value(self):
         """Return Node value, evaluate if needed and paint dependents dirty"""
+        if _PENDING_UPDATES:
+            _flush_pending_updates()
         if self._value is DIRTY:
-            self._value = self._evaluate()
+            if getattr(self._action, 'pure', False):
+                self._value = self._evaluate_pure()
+            else:
+                self._value = self._evaluate()
+                self._value_version += 1
             LOG.debug('EVALUATED %s: %s', self.name, self._value)
             self._set_dependents_dirty()
         return self._value
@@ -398,8 +825,7 @@ class Node(BaseNode):
 
     def _iterate_inputs(self):
         """Iterate through positional and keyword inputs"""
-        return itertools.chain(self._positional_inputs,
-                               values(self._keyword_inputs))
+        return iter(self._inputs)
 
     def _generate_name(self):
         """Generate a unique name for this Node object
@@ -415,48 +841,340 @@ class Node(BaseNode):
         action_name = get_func_name(self._action, '<lambda>')
         if action_name == '<lambda>':
             return super(Node, self)._generate_name()
-        counters = self._name_counters
-        counters[self.__class__, action_name] += 1
+        cls = self.__class__
+        counters = cls.__dict__.get('_action_name_counters')
+        if counters is None:
+            counters = cls._action_name_counters = defaultdict(
+                lambda: itertools.count(1))
         template = '{class_name}-{action_name}-{counter}'
-        return template.format(class_name=self.__class__.__name__,
+        return template.format(class_name=cls.__name__,
                                action_name=action_name,
-                               counter=counters[self.__class__, action_name])
+                               counter=next(counters[action_name]))
 
     def __lt__(self, other):
         return self.name < other.name
 
 
-def update_inputs_iter(inputs_and_values):
+def _fill_triggered_cache(nodes, version):
+    """Cache triggered dependents of given Nodes and all their dependents
+
+    The dependent chains of all the given Nodes are walked together
+    depth-first without recursion, so shared dependents are only visited
+    once.  The set of triggered dependents is cached with the given graph
+    version for every Node visited on the walk, so later queries starting
+    from any of them are a single lookup.  Dependents with an up-to-date
+    cache or without triggered descendants aren't walked further.
+
+    The length of the longest chain from each Node to a triggered dependent
+    is cached as well.  A Node always has a greater height than its
+    triggered descendants, so sorting by height puts triggered Nodes in
+    dependency order.
+
+    If the ``lusmu._traversal`` extension module has been compiled with
+    Cython, its identical implementation of this function is used instead.
+
+    """
+    stack = [(node, False) for node in nodes
+             if node._has_triggered_descendant
+             and node._triggered_cache[0] != version]
+    while stack:
+        node, dependents_done = stack.pop()
+        if node._triggered_cache[0] == version:
+            continue
+        if not dependents_done:
+            stack.append((node, True))
+            stack.extend((dependent, False)
+                         for dependent in node._dependents
+                         if dependent._has_triggered_descendant
+                         and dependent._triggered_cache[0] != version)
+            continue
+        dependents = node._dependents
+        # the triggered dependents might have been disconnected since
+        height = 1 + max([dependent._triggered_cache[2]
+                          for dependent in dependents
+                          if dependent._triggered
+                          or dependent._has_triggered_descendant] or [-1])
+        if len(dependents) == 1 and not dependents[0]._triggered:
+            # share the frozenset of the only dependent instead of copying it
+            triggered = dependents[0]._triggered_cache[1]
+        else:
+            # union all dependents' sets in one call to keep wide fan-outs
+            # in C code
+            triggered = set(dependent for dependent in dependents
+                            if dependent._triggered)
+            triggered.update(*[dependent._triggered_cache[1]
+                               for dependent in dependents])
+            triggered = frozenset(triggered)
+        node._triggered_cache = version, triggered, height
+
+
+try:
+    from lusmu._traversal import fill_triggered_cache as _fill_triggered_cache
+except ImportError:
+    pass
+
+
+def update_inputs_iter(inputs_and_values, compare=True):
     """Update values of multiple Inputs and trigger dependents
 
     This is a generator which iterates through the set of triggered dependent
     Nodes.
 
+    If ``compare`` is ``False``, the new values aren't compared to the
+    current ones, and all given Inputs are considered changed.  Use this
+    when each update is known to bring new values, like when streaming
+    samples of measurements, to skip comparing large vectors.
+
+    All values are set first, and the dependents of the changed Inputs are
+    then walked in one pass.  Triggered Nodes are evaluated and yielded in
+    dependency order, so a triggered Node always comes before its triggered
+    descendants.  Updates queued in a ``lazy_updates()`` block are applied
+    first.
+
     """
-    triggered = set()
-    for node, new_value in inputs_and_values:
-        triggered |= node._set_value(new_value)
-    for node in triggered:
+    if _PENDING_UPDATES:
+        _flush_pending_updates()
+    changed = [node for node, new_value in inputs_and_values
+               if node._set_value(new_value,
+                                  get_triggered=False,
+                                  compare=compare)]
+    for node in _get_triggered_order(changed):
         node.get_value()  # trigger evaluation
         yield node
 
 
-def update_inputs(inputs_and_values):
+def _get_triggered_order(changed):
+    """Return triggered dependents of changed Nodes in evaluation order
+
+    The order is cached on the first changed Node for the current graph
+    version, so repeated updates of the same Inputs in an unchanged graph skip
+    the walk and the sort.  Keeping the cache on the Nodes themselves means it
+    doesn't keep discarded graphs alive.
+
+    """
+    if not changed:
+        return ()
+    version = _GRAPH_VERSION[0]
+    key = frozenset(changed)
+    cached_version, cached_key, order = changed[0]._triggered_order
+    if cached_version != version or cached_key != key:
+        _fill_triggered_cache(changed, version)
+        triggered = set().union(*[node._triggered_cache[1]
+                                  for node in changed])
+        order = tuple(sorted(triggered,
+                             key=_get_triggered_height,
+                             reverse=True))
+        changed[0]._triggered_order = version, key, order
+    return order
+
+
+def _get_triggered_height(node):
+    """Return the cached length of the longest chain to a triggered dependent
+    """
+    return node._triggered_cache[2]
+
+
+def update_inputs(inputs_and_values, compare=True):
     """Update values of multiple Inputs and trigger dependents
 
     Use this variant of the ``update_inputs*`` functions if you don't need to
-    access the set of triggered dependent Nodes.
+    access the set of triggered dependent Nodes.  See ``update_inputs_iter()``
+    for the ``compare`` argument.
 
     """
-    for _node in update_inputs_iter(inputs_and_values):
+    for _node in update_inputs_iter(inputs_and_values, compare=compare):
         pass
 
 
-def update_inputs_get_triggered(inputs_and_values):
+def update_inputs_get_triggered(inputs_and_values, compare=True):
     """Update values of multiple Inputs and trigger dependents
 
     This variant of the ``update_inputs*`` functions returns triggered
-    dependent Nodes as a Python set.
+    dependent Nodes as a Python set.  See ``update_inputs_iter()`` for the
+    ``compare`` argument.
+
+    """
+    return set(update_inputs_iter(inputs_and_values, compare=compare))
+
+
+def _flush_pending_updates():
+    """Apply Input updates queued in ``lazy_updates()`` blocks
+
+    Only the latest value queued for each Input is used.
+
+    """
+    latest_values = {}
+    for node, new_value in _PENDING_UPDATES:
+        latest_values[node] = new_value
+    del _PENDING_UPDATES[:]
+    update_inputs(items(latest_values))
+
+
+@contextmanager
+def lazy_updates():
+    """Queue values set to Inputs and apply them together
+
+    Inside the block, setting the value of an Input only queues the update.
+    Queued updates are applied in one ``update_inputs()`` call when the value
+    of any Input or Node is read, and when the outermost block ends.  This way
+    dependents shared by several Inputs are walked only once.
+
+    If the block raises an exception, queued updates are discarded.
+
+    Example::
+
+        >>> a, b = Input(), Input()
+        >>> with lazy_updates():
+        ...     a.value = 1
+        ...     b.value = 2
 
     """
-    return set(update_inputs_iter(inputs_and_values))
+    _LAZY_UPDATES[0] += 1
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        _LAZY_UPDATES[0] -= 1
+        if not _LAZY_UPDATES[0]:
+            if completed:
+                _flush_pending_updates()
+            else:
+                del _PENDING_UPDATES[:]
+
+
+@contextmanager
+def set_verify_output_types(enabled=True):
+    """Switch output type verification on or off inside a ``with`` block
+
+    Unlike changing ``VERIFY_OUTPUT_TYPES`` directly, this also affects Nodes
+    which have already been evaluated and cached their output type check.
+    The previous setting is restored when the block ends.
+
+    Example::
+
+        >>> with set_verify_output_types(True):
+        ...     pass  # evaluate Nodes here
+
+    """
+    global VERIFY_OUTPUT_TYPES  # pylint: disable=W0603
+    previous = VERIFY_OUTPUT_TYPES
+    VERIFY_OUTPUT_TYPES = enabled
+    _reset_output_type_checks()
+    try:
+        yield
+    finally:
+        VERIFY_OUTPUT_TYPES = previous
+        _reset_output_type_checks()
+
+
+def _reset_output_type_checks():
+    """Make Nodes resolve their output type check again when evaluated"""
+    for node in list(_TYPE_CHECKED_NODES):
+        node._output_type_check = None
+    _TYPE_CHECKED_NODES.clear()
+
+
+class Plan(object):
+    """A precomputed evaluation order for a part of a graph
+
+    Applications often build a graph once and then feed new values into it
+    many times.  A Plan sorts the Nodes needed for the given outputs
+    topologically once, so each ``run()`` is a flat loop over the Nodes
+    instead of a recursive walk through the graph.
+
+    Constructor arguments
+    ---------------------
+
+    inputs: (Input, ...)
+            The Inputs whose new values are given to ``run()``
+
+    outputs: (Node, ...)
+            The Nodes whose values are returned by ``run()``
+
+    The Plan must be re-created if inputs of the Nodes in it are changed.
+    Triggered Nodes which aren't ancestors of the outputs are left dirty.
+
+    Example::
+
+        >>> a, b = Input(), Input()
+        >>> total = Node(action=lambda *args: sum(args),
+        ...              inputs=Node.inputs(a, b))
+        >>> plan = Plan([a, b], [total])
+        >>> plan.run([1, 2])
+        [3]
+
+    """
+    def __init__(self, inputs, outputs):
+        self._inputs = tuple(inputs)
+        order = self._sort(outputs)
+        slot_of = {node: index for index, node in enumerate(order)}
+        self._sources = []
+        self._steps = []
+        for index, node in enumerate(order):
+            if not isinstance(node, Node):
+                self._sources.append((index, node))
+                continue
+            if type(node)._evaluate == Node._evaluate:
+                action = node._action
+            else:
+                # subclasses may calculate their value in another way
+                action = None
+            pure = getattr(node._action, 'pure', False)
+            args = tuple(slot_of[inp] for inp in node._positional_inputs)
+            kwargs = tuple((name, slot_of[inp])
+                           for name, inp in items(node._keyword_inputs))
+            self._steps.append((index, node, action, pure, args, kwargs))
+        self._output_slots = [slot_of[node] for node in outputs]
+        self._slots = [DIRTY] * len(order)
+
+    @staticmethod
+    def _sort(outputs):
+        """Return given Nodes and their ancestors in topological order"""
+        order = []
+        visited = set()
+        stack = [(node, False) for node in reversed(list(outputs))]
+        while stack:
+            node, inputs_done = stack.pop()
+            if inputs_done:
+                order.append(node)
+            elif node not in visited:
+                visited.add(node)
+                stack.append((node, True))
+                if isinstance(node, Node):
+                    stack.extend((inp, False)
+                                 for inp in node._iterate_inputs())
+        return order
+
+    def run(self, new_values):
+        """Set new values for the Inputs and evaluate the outputs
+
+        ``new_values`` are given in the same order as the Inputs in the
+        constructor.  Nodes which aren't dirty keep their value.  Nodes with
+        pure actions are memoized as in ``get_value()``.  Returns the values
+        of the outputs as a list.
+
+        """
+        for node, new_value in zip(self._inputs, new_values):
+            node._set_value(new_value, get_triggered=False)
+        slots = self._slots
+        for index, node in self._sources:
+            slots[index] = node.get_value()
+        verify = VERIFY_OUTPUT_TYPES
+        for index, node, action, pure, args, kwargs in self._steps:
+            value = node._value
+            if value is DIRTY:
+                if pure:
+                    value = node._evaluate_pure()
+                else:
+                    if action is None or verify:
+                        value = node._evaluate()
+                    else:
+                        value = action(
+                            *[slots[i] for i in args],
+                            **{name: slots[i] for name, i in kwargs})
+                    node._value_version += 1
+                node._value = value
+                LOG.debug('EVALUATED %s: %s', node.name, value)
+            slots[index] = value
+        return [slots[index] for index in self._output_slots]
@@ -24,17 +24,24 @@ nodes and connections on the screen.  The diagram is saved in ``mouse.gif``.
 
 from lusmu.core import Input, Node, update_inputs
 from lusmu.visualization import visualize_graph
+import logging
 import math
 import Tkinter
 
 
+LOG = logging.getLogger('lusmu.examples.mouse')
+
 TARGET = {'x': 90, 'y': 110}
 RADIUS = 30
 
+# Interned so that comparing alert values is an identity check
+INSIDE = intern('INSIDE')
+OUTSIDE = intern('OUTSIDE')
+COLORS = {INSIDE: 'red', OUTSIDE: 'blue'}
+
 
 def get_distance(x, y):
-    print ('Measuring distance from ({x}, {y}) to {t[x]}'
-           .format(x=x, y=y, t=TARGET))
+    LOG.debug('Measuring distance from (%s, %s) to %s', x, y, TARGET['x'])
     dx = x - TARGET['x']
     dy = y - TARGET['y']
     return math.sqrt(dx ** 2 + dy ** 2)
@@ -45,7 +52,7 @@ def is_close_to_target(distance):
 
 
 def get_distance_description(is_close):
-    return "INSIDE" if is_close else "OUTSIDE"
+    return INSIDE if is_close else OUTSIDE
 
 
 mousex = Input(name='mouse x')
@@ -64,23 +71,50 @@ alert = Node(
     inputs=Node.inputs(is_close))
 
 
+# A drag fires lots of motion events in quick succession.  Only the latest
+# mouse coordinates are kept, and the graph is updated once Tk is idle.
+_pending = [None]
+_scheduled = [False]
+
+
 def onclick(event):
-    update_inputs([(mousex, event.x),
-                   (mousey, event.y)])
+    _pending[0] = (event.x, event.y)
+    if not _scheduled[0]:
+        root.after_idle(_flush)
+        _scheduled[0] = True
+
+
+def _flush():
+    x, y = _pending[0]
+    _pending[0] = None
+    _scheduled[0] = False
+    update_inputs([(mousex, x),
+                   (mousey, y)])
     print 'distance.value == {:.1f}'.format(distance.value)
     print 'is_close.value == {!r}'.format(is_close.value)
     print 'alert.value == {!r}'.format(alert.value)
     print
-    colors = {'INSIDE': 'red', 'OUTSIDE': 'blue'}
-    draw_circle(colors[alert.value])
+    draw_circle(COLORS[alert.value])
 
 
-def draw_circle(color):
-    tx = TARGET['x']
-    ty = TARGET['y']
-    canvas.create_oval(tx - RADIUS, ty - RADIUS, tx + RADIUS, ty + RADIUS,
-                       fill=color)
+# The canvas item id of the circle, created on the first draw and recolored
+# afterwards so repeated clicks don't pile up canvas items
+_circle = [None]
+
 
+def draw_circle(color):
+    if _circle[0] is None:
+        tx = TARGET['x']
+        ty = TARGET['y']
+        _circle[0] = canvas.create_oval(tx - RADIUS, ty - RADIUS,
+                                        tx + RADIUS, ty + RADIUS,
+                                        fill=color)
+    else:
+        canvas.itemconfig(_circle[0], fill=color)
+
+
+logging.basicConfig(format='%(message)s')
+LOG.setLevel(logging.DEBUG)
 
 root = Tkinter.Tk()
 frame = Tkinter.Frame(root)
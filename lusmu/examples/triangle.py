@@ -1,9 +1,13 @@
 from lusmu.core import Input, Node, update_inputs
 from lusmu.visualization import visualize_graph
+import logging
 import math
 import operator
 
 
+LOG = logging.getLogger('lusmu.examples.triangle')
+
+
 a = Input(name='length of cathetus a')
 b = Input(name='length of cathetus b')
 
@@ -12,12 +16,8 @@ def square(x):
     return x ** 2
 
 
-def sum_(*args):
-    return sum(args)
-
-
 def sqrt(square):
-    print '** taking square root of {:.2f}'.format(square)
+    LOG.debug('** taking square root of %.2f', square)
     return math.sqrt(square)
 
 
@@ -28,7 +28,7 @@ area_b = Node(name='square of b',
               action=square,
               inputs=Node.inputs(b))
 area_hypothenuse = Node(name='square of hypothenuse',
-                        action=sum_,
+                        action=operator.add,
                         inputs=Node.inputs(area_a, area_b))
 hypothenuse = Node(name='length of hypothenuse',
                    action=sqrt,
@@ -47,6 +47,9 @@ beta = Node(name='angle beta',
             inputs=Node.inputs(sin_beta))
 
 
+logging.basicConfig(format='%(message)s')
+LOG.setLevel(logging.DEBUG)
+
 print 'Enter float values for a and b, e.g.\n> 3.0 4.0'
 while True:
     answer = raw_input('\n> ')
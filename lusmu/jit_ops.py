@@ -0,0 +1,51 @@
+"""Numba-compiled actions for numeric Lusmu graphs
+
+Copyright 2013 Eniram Ltd. See the LICENSE file at the top-level directory of
+this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
+
+"""
+
+import numba
+
+
+def jit_action(function):
+    """Compile an action function with numba in nopython mode
+
+    No signature is given, so nothing is compiled at import time.  The
+    function is specialized for the types of its arguments on the first call,
+    and the machine code is cached on disk for later processes.
+
+    """
+    return numba.njit(cache=True)(function)
+
+
+def njit_action(function):
+    """Compile a numeric array action with numba for fast arithmetic
+
+    Like ``jit_action()``, but allows LLVM to reorder floating point
+    operations so loops can be vectorized with SIMD instructions, and
+    follows numpy instead of Python in error handling, so for example
+    division by zero gives ``inf`` instead of raising an exception.
+
+    Vector Nodes call these actions with the numpy arrays underlying any
+    pandas Series inputs, and wrap results back into Series.
+
+    """
+    compiled = numba.njit(fastmath=True,
+                          error_model='numpy',
+                          boundscheck=False,
+                          cache=True)(function)
+    compiled.unwrap_series = True
+    return compiled
+
+
+@jit_action
+def add(first, second):
+    """Return the sum of two values"""
+    return first + second
+
+
+@jit_action
+def subtract(first, second):
+    """Return the difference of two values"""
+    return first - second
@@ -13,13 +13,19 @@ this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
 #         Allow lots of public methods
 
 import gc
+import operator
 from unittest import TestCase
 from nose.tools import assert_raises
 from lusmu.core import (Node,
                         DIRTY,
                         Input,
+                        Plan,
+                        lazy_updates,
+                        set_verify_output_types,
                         update_inputs_get_triggered,
-                        _TRIGGERED_CACHE)
+                        update_inputs_iter,
+                        _GRAPH_VERSION,
+                        _RENDER_VERSION)
 from mock import patch
 import weakref
 
@@ -83,27 +89,112 @@ class NodeTestCase(TestCase):
         self.assertEqual('CounterNodeC-1', CounterNodeC().name)
         self.assertEqual('CounterNodeC-2', CounterNodeC().name)
 
+    def test_subclass_counter_not_inherited(self):
+        """A subclass doesn't share the name counter of its parent class"""
+        class ParentInput(Input):
+            """Node subclass for testing"""
+
+        self.assertEqual('ParentInput-1', ParentInput().name)
+
+        class ChildInput(ParentInput):
+            """Node subclass for testing"""
+
+        self.assertEqual('ChildInput-1', ChildInput().name)
+        self.assertEqual('ParentInput-2', ParentInput().name)
+
+    def test_name_generated_on_first_access(self):
+        """Default names are generated in the order they're first accessed"""
+        class LazyInput(Input):
+            """Node subclass for testing"""
+
+        first = LazyInput()
+        second = LazyInput()
+        self.assertEqual('LazyInput-1', second.name)
+        self.assertEqual('LazyInput-2', first.name)
+        self.assertEqual('LazyInput-1', second.name)
+
+    def test_names_interned(self):
+        """Names are interned strings"""
+        name = ''.join(['interned', '-name'])
+        self.assertIs(intern('interned-name'), Input(name).name)
+
     def test_initial_inputs(self):
         """Inputs of a node can be set up in the constructor"""
         root = ConstantNode('root')
         branch = ConstantNode('branch')
         leaf = ConstantNode('node', inputs=([root], {'branch': branch}))
-        self.assertEqual({leaf}, root._dependents)
-        self.assertEqual({leaf}, branch._dependents)
+        self.assertEqual([leaf], root._dependents)
+        self.assertEqual([leaf], branch._dependents)
         self.assertEqual((root,), leaf._positional_inputs)
         self.assertEqual({'branch': branch}, leaf._keyword_inputs)
+        self.assertEqual((), leaf._dependents)
 
     def test_changing_inputs_disconnects_dependencies(self):
         """Old dependencies are disconnected when changing inputs of a Node"""
         root1 = ConstantNode('root1')
         leaf = ConstantNode('leaf', inputs=([root1], {}))
-        self.assertEqual({leaf}, root1._dependents)
+        self.assertEqual([leaf], root1._dependents)
         root2 = ConstantNode('root2')
         root3 = ConstantNode('root3')
         leaf.set_inputs(root2, foo=root3)
-        self.assertEqual(set(), root1._dependents)
-        self.assertEqual({leaf}, root2._dependents)
-        self.assertEqual({leaf}, root3._dependents)
+        self.assertEqual([], root1._dependents)
+        self.assertEqual([leaf], root2._dependents)
+        self.assertEqual([leaf], root3._dependents)
+
+    def test_wide_fan_out(self):
+        """Many dependents of one Input are connected and disconnected"""
+        root = Input('root')
+        leaves = [ConstantNode(inputs=Node.inputs(root)) for _ in range(20)]
+        root._connect(leaves[15])
+        self.assertEqual(leaves, root._dependents)
+        leaves[3].set_inputs()
+        root._disconnect(leaves[3])
+        self.assertEqual(leaves[:3] + leaves[4:], root._dependents)
+        root._connect(leaves[3])
+        self.assertEqual(leaves[:3] + leaves[4:] + leaves[3:4],
+                         root._dependents)
+
+    def test_keyword_inputs(self):
+        """Values of keyword inputs are passed as keyword arguments"""
+        node = Node(action=lambda first, second, third: (first, second, third),
+                    inputs=Node.inputs(Input(value=1),
+                                       third=Input(value=3),
+                                       second=Input(value=2)))
+        self.assertEqual((1, 2, 3), node.value)
+
+    def test_non_identifier_keyword_inputs(self):
+        """Keyword input names don't need to be Python identifiers"""
+        node = Node(action=lambda **kwargs: kwargs,
+                    inputs=((), {'not-valid': Input(value=1),
+                                 'class': Input(value=2)}))
+        self.assertEqual({'not-valid': 1, 'class': 2}, node.value)
+
+    def test_many_inputs(self):
+        """A Node can have more inputs than Python allows in a call"""
+        inputs = [Input(value=value) for value in range(300)]
+        node = Node(action=lambda *args: sum(args),
+                    inputs=Node.inputs(*inputs))
+        self.assertEqual(44850, node.value)
+
+    def test_reducer(self):
+        """A reducer action applies its function to any number of inputs"""
+        inputs = [Input(value=value) for value in (1, 2, 3)]
+        pair = Node(action=Node.reducer(operator.add),
+                    inputs=Node.inputs(*inputs[:2]))
+        triple = Node(action=Node.reducer(operator.add),
+                      inputs=Node.inputs(*inputs))
+        self.assertEqual(3, pair.value)
+        self.assertEqual(6, triple.value)
+        self.assertEqual('reduce_add', pair._action.__name__)
+
+    def test_changing_inputs_changes_arguments(self):
+        """The action receives arguments matching the current inputs"""
+        root1 = Input(value=1)
+        leaf = Node(action=lambda *args, **kwargs: (args, kwargs),
+                    inputs=Node.inputs(root1))
+        self.assertEqual(((1,), {}), leaf.value)
+        leaf.set_inputs(foo=Input(value=2))
+        self.assertEqual(((), {'foo': 2}), leaf.value)
 
     def test_initial_value(self):
         """The initial value of an Input can be set in the constructor"""
@@ -136,7 +227,7 @@ class BaseNodeGarbageCollectionTestCase(TestCase):
         input_node = Input()
         output_node = Node(action=lambda value: value,
                            inputs=Node.inputs(input_node))
-        self.assertEqual(set([output_node]), input_node._dependents)
+        self.assertEqual([output_node], input_node._dependents)
         self.assertEqual((input_node,), output_node._positional_inputs)
         input_ref = weakref.ref(input_node)
         output_ref = weakref.ref(output_node)
@@ -152,7 +243,7 @@ class BaseNodeGarbageCollectionTestCase(TestCase):
             input_node = Input()
             output_node = Node(action=lambda value: value,
                                inputs=Node.inputs(input_node))
-            self.assertEqual(set([output_node]), input_node._dependents)
+            self.assertEqual([output_node], input_node._dependents)
             self.assertEqual((input_node,), output_node._positional_inputs)
             return weakref.ref(input_node), weakref.ref(output_node)
 
@@ -161,6 +252,37 @@ class BaseNodeGarbageCollectionTestCase(TestCase):
         self.assertEqual(None, input_ref())
         self.assertEqual(None, output_ref())
 
+    def test_garbage_collection_with_triggered_cache(self):
+        """Nodes whose triggered dependents are cached are garbage collected"""
+        input_node = Input()
+        output_node = Node(action=lambda value: value,
+                           inputs=Node.inputs(input_node),
+                           triggered=True)
+        self.assertEqual({output_node}, input_node.set_value(1))
+        input_ref = weakref.ref(input_node)
+        output_ref = weakref.ref(output_node)
+        del input_node
+        del output_node
+        gc.collect()
+        self.assertEqual(None, input_ref())
+        self.assertEqual(None, output_ref())
+
+    def test_garbage_collection_with_triggered_order(self):
+        """Nodes updated with update_inputs() are garbage collected"""
+        input_node = Input()
+        output_node = Node(action=lambda value: value,
+                           inputs=Node.inputs(input_node),
+                           triggered=True)
+        self.assertEqual({output_node},
+                         update_inputs_get_triggered([(input_node, 1)]))
+        input_ref = weakref.ref(input_node)
+        output_ref = weakref.ref(output_node)
+        del input_node
+        del output_node
+        gc.collect()
+        self.assertEqual(None, input_ref())
+        self.assertEqual(None, output_ref())
+
     def test_garbage_collection_with_finalizer_values(self):
         """Interconnected nodes with gc-unfriendly values are gc'd"""
         class Val(object):
@@ -171,7 +293,7 @@ class BaseNodeGarbageCollectionTestCase(TestCase):
         input_node = Input(value=val)
         output_node = Node(action=lambda value: value,
                            inputs=Node.inputs(input_node))
-        self.assertEqual(set([output_node]), input_node._dependents)
+        self.assertEqual([output_node], input_node._dependents)
         self.assertEqual((input_node,), output_node._positional_inputs)
         self.assertEqual(val, input_node._value)
         input_ref = weakref.ref(input_node)
@@ -182,6 +304,17 @@ class BaseNodeGarbageCollectionTestCase(TestCase):
         self.assertEqual(None, input_ref())
         self.assertEqual(None, output_ref())
 
+    def test_unreferenced_triggered_dependent_kept_alive(self):
+        """Inputs keep triggered dependents alive without other references"""
+        evaluated = []
+        input_node = Input()
+        Node(action=evaluated.append,
+             inputs=Node.inputs(input_node),
+             triggered=True)
+        gc.collect()
+        update_inputs_get_triggered([(input_node, 1)])
+        self.assertEqual([1], evaluated)
+
 
 class NodeDependentTestCase(TestCase):
     """Test case for triggered dependent Nodes"""
@@ -209,6 +342,13 @@ class NodeDependentTestCase(TestCase):
         triggered_nodes = self.root.set_value(0)
         self.assertEqual(set(), triggered_nodes)
 
+    def test_set_same_object_doesnt_trigger_dependents(self):
+        """Setting the very same object again doesn't trigger dependents"""
+        nan = float('nan')
+        self.root.set_value(nan)
+        triggered_nodes = self.root.set_value(nan)
+        self.assertEqual(set(), triggered_nodes)
+
     def test_get_triggered_dependents(self):
         """Setting a value to a dirty Node triggers dependents"""
         triggered_nodes = self.root._get_triggered_dependents()
@@ -223,6 +363,31 @@ class NodeDependentTestCase(TestCase):
         triggered_nodes = self.root._get_triggered_dependents()
         self.assertEqual({self.triggered, child1, child2}, triggered_nodes)
 
+    def test_triggered_after_connecting(self):
+        """Nodes set triggered after connecting are triggered by updates"""
+        self.root._get_triggered_dependents()
+        child = ConstantNode('child', inputs=Node.inputs(self.dependent))
+        child.triggered = True
+        triggered_nodes = self.root.set_value(0)
+        self.assertEqual({self.triggered, child}, triggered_nodes)
+
+    def test_untriggered_after_connecting(self):
+        """Nodes no longer triggered aren't returned as triggered"""
+        self.root._get_triggered_dependents()
+        self.triggered.triggered = False
+        triggered_nodes = self.root.set_value(0)
+        self.assertEqual(set(), triggered_nodes)
+
+    def test_update_inputs_triggers_node_set_triggered(self):
+        """Setting a connected Node triggered makes updates evaluate it"""
+        evaluated = []
+        input_node = Input()
+        node = Node(action=evaluated.append,
+                    inputs=Node.inputs(input_node))
+        node.triggered = True
+        update_inputs_get_triggered([(input_node, 1)])
+        self.assertEqual([1], evaluated)
+
 
 class Counting(object):
     """Mixin which counts calls to _get_triggered_dependents()"""
@@ -230,11 +395,14 @@ class Counting(object):
     def __init__(self, *args, **kwargs):
         super(Counting, self).__init__(*args, **kwargs)
         self.call_count = 0
+        get_triggered_dependents = self._get_triggered_dependents
+
+        def counting_get_triggered_dependents(*args, **kwargs):
+            """Count the call and delegate to the original bound method"""
+            self.call_count += 1
+            return get_triggered_dependents(*args, **kwargs)
 
-    def _get_triggered_dependents(self, *args, **kwargs):
-        self.call_count += 1
-        return super(Counting, self)._get_triggered_dependents(*args,
-                                                               **kwargs)
+        self._get_triggered_dependents = counting_get_triggered_dependents
 
 
 class CountingNode(Counting, ConstantNode):
@@ -260,29 +428,86 @@ class TriggeredCacheTestCase(TestCase):
     def test_cache_content(self):
         """Triggered dependents are cached for each node"""
         self.root._get_triggered_dependents()
-        self.assertEqual({self.root: {self.branch, self.leaf1, self.leaf2}},
-                         _TRIGGERED_CACHE)
+        version = _GRAPH_VERSION[0]
+        self.assertEqual(
+            (version, frozenset({self.branch, self.leaf1, self.leaf2}), 2),
+            self.root._triggered_cache)
+        self.assertEqual((version, frozenset({self.leaf1, self.leaf2}), 1),
+                         self.branch._triggered_cache)
+        # leaves have no triggered descendants, so there's nothing to cache
+        self.assertEqual((None, frozenset(), 0), self.leaf1._triggered_cache)
+        self.assertEqual((None, frozenset(), 0), self.leaf2._triggered_cache)
 
     def test_connect_clears_cache(self):
         """Connecting nodes invalidates the triggered nodes cache"""
         self.root._get_triggered_dependents()
-        self.assertEqual({self.root: {self.branch, self.leaf1, self.leaf2}},
-                         _TRIGGERED_CACHE)
-        self.root._connect(CountingNode('leaf3'))
-        self.assertEqual({}, _TRIGGERED_CACHE)
+        version = _GRAPH_VERSION[0]
+        self.assertEqual(version, self.root._triggered_cache[0])
+        leaf3 = CountingNode('leaf3', triggered=True)
+        self.root._connect(leaf3)
+        self.assertEqual(version + 1, _GRAPH_VERSION[0])
+        self.assertEqual({self.branch, self.leaf1, self.leaf2, leaf3},
+                         self.root._get_triggered_dependents())
+
+    def test_disconnect_clears_cache(self):
+        """Disconnecting nodes invalidates the triggered nodes cache"""
+        self.root._get_triggered_dependents()
+        version = _GRAPH_VERSION[0]
+        self.branch._disconnect(self.leaf2)
+        self.assertEqual(version + 1, _GRAPH_VERSION[0])
+        self.assertEqual({self.branch, self.leaf1},
+                         self.root._get_triggered_dependents())
+
+    def test_rename_keeps_cache(self):
+        """Renaming nodes doesn't invalidate the triggered nodes cache"""
+        self.root._get_triggered_dependents()
+        graph_version = _GRAPH_VERSION[0]
+        render_version = _RENDER_VERSION[0]
+        self.leaf1.name = 'renamed'
+        self.assertEqual(graph_version, _GRAPH_VERSION[0])
+        self.assertEqual(render_version + 1, _RENDER_VERSION[0])
+        self.assertEqual(graph_version, self.root._triggered_cache[0])
 
     def test_get_triggered_dependents(self):
-        """_get_triggered_dependents() isn't called again for cached nodes"""
+        """_get_triggered_dependents() isn't called for dependents"""
         self.root._get_triggered_dependents()
         self.assertEqual(1, self.root.call_count)
-        self.assertEqual(1, self.branch.call_count)
-        self.assertEqual(1, self.leaf1.call_count)
-        self.assertEqual(1, self.leaf2.call_count)
+        self.assertEqual(0, self.branch.call_count)
+        self.assertEqual(0, self.leaf1.call_count)
+        self.assertEqual(0, self.leaf2.call_count)
         self.root._get_triggered_dependents()
         self.assertEqual(2, self.root.call_count)
-        self.assertEqual(1, self.branch.call_count)
-        self.assertEqual(1, self.leaf1.call_count)
-        self.assertEqual(1, self.leaf2.call_count)
+        self.assertEqual(0, self.branch.call_count)
+
+    def test_intermediate_node_cached(self):
+        """Triggered dependents of intermediate nodes are taken from cache"""
+        self.root._get_triggered_dependents()
+        self.assertEqual({self.leaf1, self.leaf2},
+                         self.branch._get_triggered_dependents())
+        self.assertIs(self.branch._triggered_cache[1],
+                      self.branch._get_triggered_dependents())
+
+    def test_cached_dependents_not_walked(self):
+        """Triggered dependents of cached nodes are taken from the cache"""
+        self.branch._get_triggered_dependents()
+        self.branch._triggered_cache = (_GRAPH_VERSION[0],
+                                        frozenset({self.leaf1}),
+                                        1)
+        self.assertEqual({self.branch, self.leaf1},
+                         self.root._get_triggered_dependents())
+
+    def test_untriggered_chain_not_walked(self):
+        """Dependents without triggered descendants aren't walked"""
+        root = Input()
+        branch = CountingNode('branch', inputs=Node.inputs(root))
+        leaf = CountingNode('leaf', inputs=Node.inputs(branch))
+        self.assertFalse(root._has_triggered_descendant)
+        self.assertEqual(frozenset(), root._get_triggered_dependents())
+        self.assertEqual((None, frozenset(), 0), root._triggered_cache)
+        leaf._connect(CountingNode('triggered', triggered=True))
+        self.assertTrue(root._has_triggered_descendant)
+        self.assertTrue(branch._has_triggered_descendant)
+        self.assertEqual(1, len(root._get_triggered_dependents()))
 
 
 class NodeSetValueTestCase(TestCase):
@@ -323,6 +548,47 @@ class UpdateNodesTestCase(TestCase):
         triggered = update_inputs_get_triggered([(self.branch2, 2)])
         self.assertEqual({self.leaf3, self.leaf4}, triggered)
 
+    def test_multiple_inputs_triggered(self):
+        """Updating multiple Nodes triggers descendents of changed Nodes"""
+        update_inputs_get_triggered([(self.branch1, 2)])
+        triggered = update_inputs_get_triggered([(self.branch1, 2),
+                                                 (self.branch2, 3),
+                                                 (self.leaf3, 4)])
+        self.assertEqual({self.leaf3, self.leaf4}, triggered)
+
+    def test_update_without_compare(self):
+        """Equal values trigger dependents if comparison is skipped"""
+        update_inputs_get_triggered([(self.branch1, 2)])
+        self.assertEqual(set(),
+                         update_inputs_get_triggered([(self.branch1, 2)]))
+        triggered = update_inputs_get_triggered([(self.branch1, 2)],
+                                                compare=False)
+        self.assertEqual({self.leaf1, self.leaf2}, triggered)
+
+    def test_triggered_in_dependency_order(self):
+        """Triggered Nodes are evaluated before their triggered descendants"""
+        root = Input()
+        chain = [CountingNode('node{}'.format(index), triggered=True)
+                 for index in range(20)]
+        root._connect(chain[0])
+        for node, dependent in zip(chain, chain[1:]):
+            node._connect(dependent)
+        self.assertEqual(chain, list(update_inputs_iter([(root, 1)])))
+        self.assertEqual(chain[6:],
+                         list(update_inputs_iter([(chain[5], 2)])))
+
+    def test_triggered_order_cached(self):
+        """The order of triggered Nodes is reused until the graph changes"""
+        update_inputs_get_triggered([(self.root, 2)])
+        order = self.root._triggered_order[2]
+        update_inputs_get_triggered([(self.root, 3)])
+        self.assertIs(order, self.root._triggered_order[2])
+        leaf5 = CountingNode('leaf5', triggered=True)
+        self.leaf4._connect(leaf5)
+        triggered = update_inputs_get_triggered([(self.root, 4)])
+        self.assertIn(leaf5, triggered)
+        self.assertEqual(_GRAPH_VERSION[0], self.root._triggered_order[0])
+
 
 class HomeAutomationTestCase(TestCase):
     """Test case illustrating a fictitious home automation use case"""
@@ -367,6 +633,195 @@ class HomeAutomationTestCase(TestCase):
         self.assertEqual([450, 446], lamp_power_changes)
 
 
+class LazyUpdatesTestCase(TestCase):
+    """Test case for queuing Input updates with lazy_updates()"""
+
+    def setUp(self):
+        self.evaluated = []
+        self.a = Input(value=1)
+        self.b = Input(value=2)
+        self.total = Node(action=lambda *args: sum(args),
+                          inputs=Node.inputs(self.a, self.b))
+        self.triggered = Node(action=self.evaluated.append,
+                              inputs=Node.inputs(self.total),
+                              triggered=True)
+
+    def test_updates_queued(self):
+        """Setting Input values inside the block only queues them"""
+        with lazy_updates():
+            self.assertEqual(set(), self.a.set_value(3))
+            self.assertEqual(1, self.a._value)
+        self.assertEqual(3, self.a._value)
+
+    def test_block_end_triggers(self):
+        """Queued updates trigger dependents at the end of the block"""
+        with lazy_updates():
+            self.a.value = 3
+            self.b.value = 4
+            self.assertEqual([], self.evaluated)
+        self.assertEqual([7], self.evaluated)
+
+    def test_read_flushes(self):
+        """Reading a value applies queued updates"""
+        with lazy_updates():
+            self.a.value = 3
+            self.assertEqual(5, self.total.value)
+            self.b.value = 4
+            self.assertEqual(4, self.b.value)
+        self.assertEqual([5, 7], self.evaluated)
+
+    def test_last_update_wins(self):
+        """Only the latest queued value of an Input is used"""
+        with lazy_updates():
+            self.a.value = 3
+            self.a.value = 5
+        self.assertEqual([7], self.evaluated)
+
+    def test_nested_blocks(self):
+        """Updates are applied when the outermost block ends"""
+        with lazy_updates():
+            with lazy_updates():
+                self.a.value = 3
+            self.assertEqual(1, self.a._value)
+        self.assertEqual(3, self.a._value)
+
+    def test_exception_discards_updates(self):
+        """Queued updates are discarded if the block raises an exception"""
+        with self.assertRaises(ValueError):
+            with lazy_updates():
+                self.a.value = 3
+                raise ValueError()
+        self.assertEqual(1, self.a.value)
+
+
+class PureActionTestCase(TestCase):
+    """Test case for memoizing the values of Nodes with pure actions"""
+
+    def setUp(self):
+        self.calls = []
+
+        def tens(value):
+            self.calls.append('tens')
+            return value // 10
+        tens.pure = True
+
+        def double(value):
+            self.calls.append('double')
+            return 2 * value
+        double.pure = True
+
+        self.input = Input(value=15)
+        self.tens = Node(action=tens, inputs=Node.inputs(self.input))
+        self.double = Node(action=double, inputs=Node.inputs(self.tens))
+
+    def test_unchanged_result_not_propagated(self):
+        """Pure dependents aren't re-calculated if a value stays the same"""
+        self.assertEqual(2, self.double.value)
+        self.input.value = 17
+        self.assertEqual(2, self.double.value)
+        self.assertEqual(['tens', 'double', 'tens'], self.calls)
+
+    def test_changed_result_propagated(self):
+        """Pure dependents are re-calculated if a value changes"""
+        self.assertEqual(2, self.double.value)
+        self.input.value = 25
+        self.assertEqual(4, self.double.value)
+        self.assertEqual(['tens', 'double', 'tens', 'double'], self.calls)
+
+    def test_changed_inputs_recalculate(self):
+        """Replacing the inputs of a pure Node causes re-calculation"""
+        self.assertEqual(1, self.tens.value)
+        self.tens.set_inputs(Input(value=15))
+        self.assertEqual(1, self.tens.value)
+        self.assertEqual(['tens', 'tens'], self.calls)
+
+    def test_impure_always_recalculated(self):
+        """Actions without the pure attribute are called on every change"""
+        calls = []
+        node = Node(action=calls.append, inputs=Node.inputs(self.tens))
+        node.get_value()
+        self.input.value = 17
+        node.get_value()
+        self.assertEqual([1, 1], calls)
+
+
+class PlanTestCase(TestCase):
+    """Test case for evaluating graphs using a Plan"""
+
+    def setUp(self):
+        self.calls = []
+
+        def square(value):
+            """Square the value and record the call"""
+            self.calls.append('square')
+            return value ** 2
+
+        def subtract(first, second):
+            """Subtract values and record the call"""
+            self.calls.append('subtract')
+            return first - second
+
+        self.a = Input()
+        self.b = Input()
+        self.square_a = Node(action=square, inputs=Node.inputs(self.a))
+        self.constant = ConstantNode()
+        self.difference = Node(
+            action=subtract,
+            inputs=Node.inputs(self.square_a, second=self.b))
+        self.total = Node(action=lambda *args: sum(args),
+                          inputs=Node.inputs(self.difference,
+                                             self.constant,
+                                             self.square_a))
+        self.plan = Plan([self.a, self.b], [self.total, self.difference])
+
+    def test_run(self):
+        """Running a plan returns values of the outputs"""
+        self.assertEqual([17, 7], self.plan.run([3, 2]))
+
+    def test_values_stored(self):
+        """Running a plan stores values in the nodes"""
+        self.plan.run([3, 2])
+        self.assertEqual(9, self.square_a._value)
+        self.assertEqual(1, self.constant._value)
+        self.assertEqual(17, self.total.value)
+
+    def test_unchanged_nodes_not_evaluated(self):
+        """Nodes which aren't dirty aren't evaluated again"""
+        self.plan.run([3, 2])
+        self.plan.run([3, 1])
+        self.assertEqual(['square', 'subtract', 'subtract'], self.calls)
+        self.assertEqual([18, 8], self.plan.run([3, 1]))
+
+    def test_non_input_sources(self):
+        """Values of Inputs not given to run() are used as they are"""
+        plan = Plan([self.a], [self.difference])
+        self.b.value = 4
+        self.assertEqual([5], plan.run([3]))
+
+    def test_pure_node_memoized(self):
+        """Pure Nodes aren't re-calculated for unchanged input values"""
+        def tens(value):
+            """Divide the value by ten and record the call"""
+            self.calls.append('tens')
+            return value // 10
+        tens.pure = True
+
+        def double(value):
+            """Double the value and record the call"""
+            self.calls.append('double')
+            return 2 * value
+        double.pure = True
+
+        tens_node = Node(action=tens, inputs=Node.inputs(self.a))
+        double_node = Node(action=double, inputs=Node.inputs(tens_node))
+        plan = Plan([self.a], [double_node])
+        self.assertEqual([2], plan.run([15]))
+        version = double_node._value_version
+        self.assertEqual([2], plan.run([17]))
+        self.assertEqual(['tens', 'double', 'tens'], self.calls)
+        self.assertEqual(version, double_node._value_version)
+
+
 class MockActionBase(object):
     def __call__(self, data):
         return data
@@ -415,6 +870,29 @@ class NodeVerifyOutputTypeTestCase(TestCase):
         self.input.value = '42'
         node._evaluate()
 
+    def test_check_resolved_on_first_evaluation(self):
+        """The output type check is resolved once and reused"""
+        node = Node(action=IntOutputTypeAction(),
+                    inputs=Node.inputs(self.input))
+        self.input.value = '42'
+        resolve = Node.__dict__['_resolve_output_type_check']
+        with patch.object(Node, '_resolve_output_type_check',
+                          autospec=True, side_effect=resolve) as resolve_check:
+            node._evaluate()
+            with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
+                node._evaluate()
+        self.assertEqual(1, resolve_check.call_count)
+
+    def test_set_verify_output_types(self):
+        node = Node(action=IntOutputTypeAction(),
+                    inputs=Node.inputs(self.input))
+        self.input.value = '42'
+        node._evaluate()
+        with set_verify_output_types(True):
+            with assert_raises(TypeError):
+                node._evaluate()
+        node._evaluate()
+
     def test_enabled_and_no_output_type(self):
         with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
             node = Node(action=NoOutputTypeAction(),
@@ -0,0 +1,104 @@
+"""Test suite for lusmu.jit_ops
+
+Copyright 2013 Eniram Ltd. See the LICENSE file at the top-level directory of
+this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
+
+"""
+
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from lusmu.core import Input, Node, update_inputs_get_triggered
+from lusmu.jit_ops import add, jit_action, njit_action, subtract
+from lusmu import vector
+
+
+class JitActionTestCase(TestCase):
+    """Test case for numba-compiled actions"""
+
+    def test_jit_action(self):
+        """A compiled action returns the same result as the Python function"""
+        @jit_action
+        def square(value):
+            """Return the square of a value"""
+            return value ** 2
+
+        self.assertEqual(9, square(3))
+        self.assertEqual(2.25, square(1.5))
+
+    def test_vector_values(self):
+        """Compiled actions work with numpy arrays"""
+        result = subtract(np.array([5, 7]), add(np.array([1, 2]), 1))
+        self.assertEqual([3, 4], list(result))
+
+
+class NjitActionTestCase(TestCase):
+    """Test case for numba-compiled array actions"""
+
+    def setUp(self):
+        @njit_action
+        def relative_change(value, reference):
+            """Return the change of value relative to a reference"""
+            return (value - reference) / reference
+
+        self.action = relative_change
+
+    def test_numpy_error_model(self):
+        """Division by zero follows numpy semantics"""
+        result = self.action(np.array([1., 2.]), np.array([2., 0.]))
+        self.assertEqual([-.5, np.inf], list(result))
+
+    def test_series_inputs(self):
+        """Vector Nodes pass arrays to the action and get a Series back"""
+        index = pd.to_datetime(['2013-10-15', '2013-10-16'])
+        value = vector.Input(value=pd.Series([3., 6.], index=index))
+        reference = vector.Input(value=pd.Series([2., 4.], index=index))
+        node = vector.Node(action=self.action,
+                           inputs=vector.Node.inputs(value,
+                                                     reference=reference))
+        result = node.value
+        self.assertIsInstance(result, pd.Series)
+        self.assertIs(index, result.index)
+        self.assertEqual([.5, .5], list(result))
+
+
+class JitHomeAutomationTestCase(TestCase):
+    """The home automation test case using numba-compiled actions"""
+
+    def test_home_automation(self):
+        """A simple example in the home automation domain"""
+        brightness_1 = Input()
+        brightness_2 = Input()
+        brightness_max = Input(value=510)
+        brightness_sum = Node(action=add,
+                              inputs=Node.inputs(brightness_1, brightness_2))
+        brightness_inverse = Node(
+            action=subtract,
+            inputs=Node.inputs(brightness_max, brightness_sum))
+
+        lamp_power_changes = []
+
+        def set_lamp_power(value):
+            """Log changes to lamp power"""
+            lamp_power_changes.append(value)
+
+        _lamp_power = Node(action=set_lamp_power,
+                           inputs=Node.inputs(brightness_inverse),
+                           triggered=True)
+
+        update_inputs_get_triggered([(brightness_1, 20),
+                                     (brightness_2, 40)])
+
+        self.assertEqual([450], lamp_power_changes)
+
+        update_inputs_get_triggered([(brightness_1, 20),
+                                     (brightness_2, 40)])
+
+        self.assertEqual([450], lamp_power_changes)
+
+        update_inputs_get_triggered([(brightness_1, 24),
+                                     (brightness_2, 40)])
+
+        self.assertEqual([450, 446], lamp_power_changes)
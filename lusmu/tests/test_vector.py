@@ -4,13 +4,17 @@ Copyright 2013 Eniram Ltd. See the LICENSE file at the top-level directory of
 this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
 
 """
-import tempfile
+from functools import reduce
+import io
+from operator import add
+import pickle
 from unittest import TestCase
 
 from mock import patch
 import joblib
 from nose.tools import assert_raises, eq_
 import numpy as np
+from numpy.testing import assert_array_equal
 import pandas as pd
 
 from lusmu.core import DIRTY
@@ -22,8 +26,25 @@ from lusmu import vector
 from lusmu.tests.tools import parameterize
 
 
-def sum(*args):
-    return sum(args)
+def _add_op(*args):
+    """Sum all arguments, used as a picklable Node action"""
+    return reduce(add, args, 0)
+
+
+_DATETIME_INDEXES = {}
+
+
+def _to_datetime(index):
+    """Convert a list of date strings to a DatetimeIndex
+
+    The same lists of dates are used in many test cases, so parsed indices
+    are reused.  This is safe since indices are immutable.
+
+    """
+    key = tuple(index)
+    if key not in _DATETIME_INDEXES:
+        _DATETIME_INDEXES[key] = pd.to_datetime(index)
+    return _DATETIME_INDEXES[key]
 
 
 class VectorEq(vector.VectorEquality):
@@ -32,6 +53,24 @@ class VectorEq(vector.VectorEquality):
         self._value = value
 
 
+# identical NaN objects are equal
+_NAN = float('nan')
+
+_SCALAR_EQUALITY_CASES = (
+    (DIRTY, DIRTY, True),
+    (DIRTY, 0, False),
+    (0, 0, True),
+    (0, 1, False),
+    (0, 0.0, False),
+    (0, 1.0, False),
+    (0.0, 0.0, True),
+    (0.0, 1.0, False),
+    ('a', 'a', True),
+    ('a', 'b', False),
+    (_NAN, _NAN, True),
+)
+
+
 def test_scalar_equality():
     """Test cases for lusmu.vector.VectorEq._value_eq() with Python scalars"""
 
@@ -44,16 +83,22 @@ def test_scalar_equality():
         vector = VectorEq(value)
         assert expected == vector._value_eq(other_value)
 
-    yield check(DIRTY, DIRTY, True)
-    yield check(DIRTY, 0, False)
-    yield check(0, 0, True)
-    yield check(0, 1, False)
-    yield check(0, 0.0, False)
-    yield check(0, 1.0, False)
-    yield check(0.0, 0.0, True)
-    yield check(0.0, 1.0, False)
-    yield check('a', 'a', True)
-    yield check('a', 'b', False)
+    for case in _SCALAR_EQUALITY_CASES:
+        yield check(*case)
+
+
+_NUMPY_EQUALITY_CASES = (
+    (np.array([]), np.array([]), True),
+    (np.array([1]), np.array([]), False),
+    (np.array([]), np.array([2]), False),
+    (np.array([3]), np.array([3]), True),
+    (np.array([4]), np.array([4, 5]), False),
+    (np.array([4]), np.array([4, 4]), False),
+    (np.array([4, 5]), np.array([4]), False),
+    (np.array([6, 7, 8]), np.array([6, 7, 8]), True),
+    (np.array([9, np.nan]), np.array([9, np.nan]), True),
+    (np.array([9, 10]), np.array([9, np.nan]), False),
+)
 
 
 def test_numpy_vector_equality():
@@ -65,19 +110,45 @@ def test_numpy_vector_equality():
         # pylint: disable=W0212
         #         Access to a protected member of a client class
 
-        vector = VectorEq(np.array(value))
-        assert expected == vector._value_eq(np.array(other_value))
+        vector = VectorEq(value)
+        assert expected == vector._value_eq(other_value)
 
-    yield check([], [], True)
-    yield check([1], [], False)
-    yield check([], [2], False)
-    yield check([3], [3], True)
-    yield check([4], [4, 5], False)
-    yield check([4], [4, 4], False)
-    yield check([4, 5], [4], False)
-    yield check([6, 7, 8], [6, 7, 8], True)
-    yield check([9, np.nan], [9, np.nan], True)
-    yield check([9, 10], [9, np.nan], False)
+    for case in _NUMPY_EQUALITY_CASES:
+        yield check(*case)
+
+
+_NAN_ARRAY = np.array([np.nan])
+
+_NUMPY_OTHER_EQUALITY_CASES = (
+    (DIRTY, np.array([[1,2],[3,4]]), False),
+    (np.array([[1,2],[3,4]]), np.array([[1,2],[3,4]]), True),
+    (np.array([[1,2],[3,4]]), np.array([[1,2],[3,5]]), False),
+    (np.array([[1,2],[3,4]]), [[1,2],[3,4]], False),
+    (np.array([[1,2]]), np.array([[1,2],[1,2]]), False),
+    (_NAN_ARRAY, _NAN_ARRAY, True),
+    (np.array([[1., np.nan]]), np.array([[1., np.nan]]), True),
+    (np.array([[1., np.nan]]), np.array([[1., 2.]]), False),
+    (np.array([1., 2.], dtype=np.float32), np.array([1., 2.]), True),
+    (np.array([1., np.nan], dtype=np.float16),
+     np.array([1., np.nan], dtype=np.float16),
+     True),
+    (np.array([1., 2.], dtype=np.float16),
+     np.array([1., 3.], dtype=np.float16),
+     False),
+    (np.array([1., np.nan], dtype='>f8'),
+     np.array([1., np.nan], dtype='>f8'),
+     True),
+    (np.array([1., 2.], dtype='>f8'), np.array([1., 2.]), True),
+    (np.array([1., 2., 3.], dtype='>f8'),
+     np.array([1., 4., 3.], dtype='>f8'),
+     False),
+    (np.array([[1., np.nan], [3., 4.]]).T,
+     np.array([[1., 3.], [np.nan, 4.]]),
+     True),
+    (np.array([[1., 2.], [3., 4.]]),
+     np.array([[1., 3.], [2., 4.]]),
+     False),
+)
 
 
 def test_numpy_vector_equality_others():
@@ -93,11 +164,37 @@ def test_numpy_vector_equality_others():
         vector = VectorEq(value)
         assert expected == vector._value_eq(other_value)
 
-    yield check(DIRTY, np.array([[1,2],[3,4]]), False)
-    yield check(np.array([[1,2],[3,4]]), np.array([[1,2],[3,4]]), True)
-    yield check(np.array([[1,2],[3,4]]), np.array([[1,2],[3,5]]), False)
-    yield check(np.array([[1,2],[3,4]]), [[1,2],[3,4]], False)
-    yield check(np.array([[1,2]]), np.array([[1,2],[1,2]]), False)
+    for case in _NUMPY_OTHER_EQUALITY_CASES:
+        yield check(*case)
+
+
+_PANDAS_EQUALITY_CASES = (
+    ([], [], [], [], True),
+    ([1], ['2013-10-15'], [], [], False),
+    ([], [], [2], ['2013-10-15'], False),
+    ([3], ['2013-10-15'], [3], ['2013-10-15'], True),
+    ([4], ['2013-10-15'], [4, 5],
+     ['2013-10-15', '2013-10-16'],
+     False),
+    ([4, 5], ['2013-10-15', '2013-10-16'],
+     [4], ['2013-10-15'],
+     False),
+    ([6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-17'],
+     [6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-17'],
+     True),
+    ([6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-17'],
+     [6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-18'],
+     False),
+    ([9, np.nan], ['2013-10-15', '2013-10-16'],
+     [9, np.nan], ['2013-10-15', '2013-10-16'],
+     True),
+    ([9, np.nan], ['2013-10-15', '2013-10-16'],
+     [9, np.nan], ['2013-10-15', '2013-10-17'],
+     False),
+    ([9, 10], ['2013-10-15', '2013-10-16'],
+     [9, np.nan], ['2013-10-15', '2013-10-16'],
+     False),
+)
 
 
 def test_pandas_vector_equality():
@@ -108,37 +205,58 @@ def test_pandas_vector_equality():
         """Series node value {0}/{1} == {2}/{3}: {4}"""
         # pylint: disable=W0212
         #         Access to a protected member of a client class
-        this = pd.Series(value, index=pd.to_datetime(index))
-        other = pd.Series(other_value, index=pd.to_datetime(other_index))
+        this = pd.Series(value, index=_to_datetime(index))
+        other = pd.Series(other_value, index=_to_datetime(other_index))
         vector = VectorEq(this)
 
         assert expected == vector._value_eq(other)
 
-    yield check([], [], [], [], True)
-    yield check([1], ['2013-10-15'], [], [], False)
-    yield check([], [], [2], ['2013-10-15'], False)
-    yield check([3], ['2013-10-15'], [3], ['2013-10-15'], True)
-    yield check([4], ['2013-10-15'], [4, 5],
-                ['2013-10-15', '2013-10-16'],
-                False)
-    yield check([4, 5], ['2013-10-15', '2013-10-16'],
-                [4], ['2013-10-15'],
-                False)
-    yield check([6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-17'],
-                [6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-17'],
-                True)
-    yield check([6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-17'],
-                [6, 7, 8], ['2013-10-15', '2013-10-16', '2013-10-18'],
-                False)
-    yield check([9, np.nan], ['2013-10-15', '2013-10-16'],
-                [9, np.nan], ['2013-10-15', '2013-10-16'],
-                True)
-    yield check([9, np.nan], ['2013-10-15', '2013-10-16'],
-                [9, np.nan], ['2013-10-15', '2013-10-17'],
-                False)
-    yield check([9, 10], ['2013-10-15', '2013-10-16'],
-                [9, np.nan], ['2013-10-15', '2013-10-16'],
-                False)
+    for case in _PANDAS_EQUALITY_CASES:
+        yield check(*case)
+
+
+def test_pandas_shared_index_equality():
+    """Series sharing the same index object are compared by values"""
+    # pylint: disable=W0212
+    #         Access to a protected member of a client class
+    index = pd.to_datetime(['2013-10-15', '2013-10-16'])
+    vector = VectorEq(pd.Series([9, np.nan], index=index))
+
+    assert vector._value_eq(pd.Series([9, np.nan], index=index))
+    assert not vector._value_eq(pd.Series([9, 10], index=index))
+
+
+def test_pandas_equal_index_equality():
+    """Series with equal but distinct index objects are compared by values"""
+    # pylint: disable=W0212
+    #         Access to a protected member of a client class
+    dates = ['2013-10-15', '2013-10-16']
+    vector = VectorEq(pd.Series([9, np.nan], index=pd.to_datetime(dates)))
+
+    assert vector._value_eq(pd.Series([9, np.nan],
+                                      index=pd.to_datetime(dates)))
+    assert not vector._value_eq(pd.Series([9, 10],
+                                          index=pd.to_datetime(dates)))
+
+
+def test_pandas_non_numeric_index_equality():
+    """Series with non-numeric indices can be compared"""
+    # pylint: disable=W0212
+    #         Access to a protected member of a client class
+    vector = VectorEq(pd.Series([1, 2], index=['a', 'b']))
+
+    assert vector._value_eq(pd.Series([1, 2], index=['a', 'b']))
+    assert not vector._value_eq(pd.Series([1, 2], index=['a', 'c']))
+
+
+_MIXED_EQUALITY_CASES = (
+    ([], [], [], False),
+    ([1], ['2013-10-15'], [], False),
+    ([], [], [2], False),
+    ([3], ['2013-10-15'], [3], False),
+    ([4], ['2013-10-15'], [4, 5], False),
+    ([4, 5], ['2013-10-15', '2013-10-16'], [4], False),
+)
 
 
 def test_mixed_vector_equality():
@@ -149,18 +267,66 @@ def test_mixed_vector_equality():
         """Series node value {0}/{1} == {2}: {3}"""
         # pylint: disable=W0212
         #         Access to a protected member of a client class
-        this = pd.Series(value, index=pd.to_datetime(index))
+        this = pd.Series(value, index=_to_datetime(index))
         other = np.array(other_value)
         vector = VectorEq(this)
 
         assert expected == vector._value_eq(other)
 
-    yield check([], [], [], False)
-    yield check([1], ['2013-10-15'], [], False)
-    yield check([], [], [2], False)
-    yield check([3], ['2013-10-15'], [3], False)
-    yield check([4], ['2013-10-15'], [4, 5], False)
-    yield check([4, 5], ['2013-10-15', '2013-10-16'], [4], False)
+    for case in _MIXED_EQUALITY_CASES:
+        yield check(*case)
+
+
+class VectorEqTestCase(TestCase):
+    """Test case for lusmu.vector.vector_eq()"""
+
+    def test_broadcastable_shapes_not_equal(self):
+        """Arrays which would broadcast to equal arrays aren't equal"""
+        column = np.array([[1.], [np.nan]])
+        rows = np.array([[1., 1.], [np.nan, np.nan]])
+        for eq_nan in vector._eq_nan, None:
+            with patch('lusmu.vector._eq_nan', eq_nan):
+                self.assertFalse(vector.vector_eq(column, rows))
+                self.assertTrue(vector.vector_eq(rows, rows.copy()))
+
+    def test_numexpr_and_numpy_comparisons(self):
+        """NaNs are equal with both numexpr and numpy comparisons"""
+        a = np.array([[1., np.nan], [3., 4.]]).T
+        b = np.array([[1., 3.], [np.nan, 4.]])
+        c = np.array([[1., 3.], [np.nan, 5.]])
+        for numexpr_min_size in 0, vector._NUMEXPR_MIN_SIZE:
+            with patch('lusmu.vector._NUMEXPR_MIN_SIZE', numexpr_min_size):
+                self.assertTrue(vector.vector_eq(a, b))
+                self.assertFalse(vector.vector_eq(a, c))
+                self.assertTrue(vector.vector_eq(a.astype(np.float32), b))
+                self.assertTrue(vector.vector_eq(a.astype(complex), b + 0j))
+
+    def test_shared_memory_not_scanned(self):
+        """Arrays viewing the same memory are equal without a scan"""
+        a = np.array([1., np.nan, 3.])
+        with patch('lusmu.vector._ends_differ') as ends_differ:
+            self.assertTrue(vector.vector_eq(a, a.view()))
+            self.assertTrue(vector.vector_eq(a, a[:]))
+        self.assertEqual(0, ends_differ.call_count)
+        self.assertFalse(vector.vector_eq(a[:2], a[1:]))
+
+    def test_float_bit_patterns(self):
+        """Floats are equal if bits match or values are equal"""
+        a = np.array([1., np.nan, -0., 4.])
+        with patch('lusmu.vector._eq_nan', None):
+            self.assertTrue(vector.vector_eq(a, a.copy()))
+            positive_zero = np.array([1., np.nan, 0., 4.])
+            self.assertTrue(vector.vector_eq(a, positive_zero))
+            self.assertFalse(vector.vector_eq(a, np.array([1., 2., 3., 4.])))
+
+    def test_different_ends_not_scanned(self):
+        """Arrays with different first or last elements aren't scanned"""
+        a = np.array([[1., np.nan], [3., 4.]]).T
+        with patch('lusmu.vector._NUMEXPR_MIN_SIZE', 0):
+            with patch('lusmu.vector.ne.evaluate') as evaluate:
+                self.assertFalse(vector.vector_eq(a, a + [[0.], [1.]]))
+                self.assertFalse(vector.vector_eq(a, a + [[1.], [0.]]))
+        self.assertEqual(0, evaluate.call_count)
 
 
 class InputSetValueTestCase(TestCase):
@@ -185,6 +351,35 @@ class InputSetValueTestCase(TestCase):
 
         eq_(1002, inp.last_timestamp)
 
+    def test_datetime_index(self):
+        inp = vector.Input()
+        inp.value = pd.Series([1, 2], index=_to_datetime(['2013-10-15',
+                                                          '2013-10-16']))
+
+        self.assertIsInstance(inp.last_timestamp, pd.Timestamp)
+        eq_(pd.Timestamp('2013-10-16'), inp.last_timestamp)
+
+    def test_timezone_aware_datetime_index(self):
+        inp = vector.Input()
+        index = pd.date_range('2013-10-15', periods=2, tz='Europe/Helsinki')
+        inp.value = pd.Series([1, 2], index=index)
+
+        eq_(index[-1], inp.last_timestamp)
+        eq_('Europe/Helsinki', str(inp.last_timestamp.tz))
+
+    def test_period_index(self):
+        inp = vector.Input()
+        index = pd.period_range('2013-10-15', periods=2, freq='D')
+        inp.value = pd.Series([1, 2], index=index)
+
+        eq_(pd.Period('2013-10-16', freq='D'), inp.last_timestamp)
+
+    def test_epoch_timestamp(self):
+        inp = vector.Input(value=pd.Series([1], index=[1001]))
+        inp.value = pd.Series([2], index=[0])
+
+        eq_(0, inp.last_timestamp)
+
     def test_scalar_value(self):
         inp = vector.Input(value=100000.0)
 
@@ -197,19 +392,63 @@ class InputSetValueTestCase(TestCase):
 
 
 def _pickle_unpickle(data):
-    with tempfile.NamedTemporaryFile(delete=True) as pickle_file:
-        pickle_file.close()
-
-        joblib.dump(data, pickle_file.name)
-        return joblib.load(pickle_file.name)
+    return pickle.loads(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+# arguments: (node class, attribute, value to set,
+#             expected value/exception/test)
+_PICKLING_CASES = (
+    (vector.Input, 'name', 'constant',
+     'constant'),
+    (vector.Input, '_value', 42.0,
+     42.0),
+    (vector.Input, '_value', DIRTY,
+     DIRTY),
+    (vector.Input, '_value', np.array([42.0]),
+     np.array([42.0])),
+    (vector.Input, 'last_timestamp', 1234,
+     1234),
+
+    (vector.Node, 'name', 'constant',
+     'constant'),
+    (vector.Node, '_value', 42.0,
+     42.0),
+    (vector.Node, '_value', np.array([42.0]),
+     np.array([42.0])),
+    (vector.Node, '_action', _add_op,
+     lambda _action: _action == _add_op),
+    (vector.Node, 'triggered', True,
+     True),
+    (vector.Node, '_positional_inputs',
+     (vector.Input(name='foo'),),
+     (lambda _positional_inputs:
+      [n.name for n in _positional_inputs] == ['foo'])),
+    (vector.Node, '_keyword_inputs',
+     {'foo': vector.Input(name='bar')},
+     (lambda _keyword_inputs:
+      {k: v.name for k, v in _keyword_inputs.items()}
+      == {'foo': 'bar'})),
+)
+
+
+# constructor arguments for setting attributes in the pickling test cases
+_CONSTRUCTOR_ARGUMENTS = {(vector.Input, 'name'): 'name',
+                          (vector.Input, '_value'): 'value',
+                          (vector.Node, 'name'): 'name',
+                          (vector.Node, '_action'): 'action',
+                          (vector.Node, 'triggered'): 'triggered'}
 
 
 def test_pickling():
     @parameterize
     def check(node_class, attribute, value, expected):
         """{0.__name__}.{1} pickling works as expected"""
-        node = node_class()
-        setattr(node, attribute, value)
+        argument = _CONSTRUCTOR_ARGUMENTS.get((node_class, attribute))
+        if argument:
+            node = node_class(**{argument: value})
+        else:
+            node = node_class()
+            setattr(node, attribute, value)
 
         unpickled_node = _pickle_unpickle(node)
 
@@ -220,46 +459,87 @@ def test_pickling():
             if callable(expected):
                 assert expected(value)
             elif isinstance(expected, np.ndarray):
-                assert vector.vector_eq(expected, value)
+                assert_array_equal(expected, value)
             else:
                 assert expected == value
 
-    # arguments: (node class, attribute, value to set,
-    #             expected value/exception/test)
-    yield check(vector.Input, 'name', 'constant',
-                'constant')
-    yield check(vector.Input, '_value', 42.0,
-                42.0)
-    yield check(vector.Input, '_value', DIRTY,
-                DIRTY)
-    yield check(vector.Input, '_value', np.array([42.0]),
-                np.array([42.0]))
-    yield check(vector.Input, 'last_timestamp', 1234,
-                1234)
-    yield check(vector.Input, 'extra_attribute', 42.0,
-                AttributeError)
-
-    yield check(vector.Node, 'name', 'constant',
-                'constant')
-    yield check(vector.Node, '_value', 42.0,
-                42.0)
-    yield check(vector.Node, '_value', np.array([42.0]),
-                np.array([42.0]))
-    yield check(vector.Node, '_action', sum,
-                lambda _action: _action == sum)
-    yield check(vector.Node, 'triggered', True,
-                True)
-    yield check(vector.Node, '_positional_inputs',
-                (vector.Input(name='foo'),),
-                (lambda _positional_inputs:
-                 [n.name for n in _positional_inputs] == ['foo']))
-    yield check(vector.Node, '_keyword_inputs',
-                {'foo': vector.Input(name='bar')},
-                (lambda _keyword_inputs:
-                 {k: v.name for k, v in _keyword_inputs.items()}
-                 == {'foo': 'bar'}))
-    yield check(vector.Node, 'extra_attribute', 42.0,
-                AttributeError)
+    for case in _PICKLING_CASES:
+        yield check(*case)
+
+
+# ``[a, n, m]`` pickled by an older version, which stored dependents in a set
+# and positional and keyword inputs separately:
+# a = Input(name='a')
+# n = Node(name='n', action=operator.neg, inputs=Node.inputs(a),
+#          triggered=True)
+# m = Node(name='m', action=operator.add, inputs=Node.inputs(n, y=a))
+_LEGACY_PICKLE = (
+    b'(lp0\nccopy_reg\n_reconstructor\np1\n(clusmu.vector\nInput\np2\nc__'
+    b"builtin__\nobject\np3\nNtp4\nRp5\n(dp6\nS'_dependents'\np7\nc__buil"
+    b'tin__\nset\np8\n((lp9\ng1\n(clusmu.vector\nNode\np10\ng3\nNtp11\nRp'
+    b'12\n(dp13\ng7\ng8\n((lp14\ng1\n(g10\ng3\nNtp15\nRp16\n(dp17\ng7\ng8'
+    b"\n((lp18\ntp19\nRp20\nsS'name'\np21\nS'm'\np22\nsS'triggered'\np23"
+    b"\nI00\nsS'_action'\np24\ncoperator\nadd\np25\nsS'_value'\np26\ng1\n"
+    b"(clusmu.core\n_DIRTY\np27\ng3\nNtp28\nRp29\nsS'_keyword_inputs'\np3"
+    b"0\n(dp31\nS'y'\np32\ng5\nssS'_positional_inputs'\np33\n(g12\ntp34\n"
+    b"sbatp35\nRp36\nsg21\nS'n'\np37\nsg23\nI01\nsg24\ncoperator\nneg\np3"
+    b'8\nsg26\ng29\nsg30\n(dp39\nsg33\n(g5\ntp40\nsbag16\natp41\nRp42\nsg'
+    b"26\ng29\nsg21\nS'a'\np43\nsS'last_timestamp'\np44\nNsbag12\nag16\na"
+    b'.')
+
+
+def test_unpickle_legacy_graph():
+    """Graphs pickled by older versions can be unpickled"""
+    a, n, m = pickle.loads(_LEGACY_PICKLE)
+    eq_(['a', 'n', 'm'], [a.name, n.name, m.name])
+    eq_((a,), n._inputs)
+    eq_((n, a), m._inputs)
+    eq_(('y',), m._keyword_names)
+    eq_({'y': a}, m._keyword_inputs)
+    eq_([True, False], [n.triggered, m.triggered])
+    eq_({n, m}, set(a._dependents))
+    eq_([m], n._dependents)
+    a.value = 3
+    eq_(-3, n.value)
+
+
+def test_no_extra_attributes():
+    """Vector Inputs and Nodes store attributes in slots only"""
+    @parameterize
+    def check(node_class):
+        """{0.__name__} doesn't accept extra attributes"""
+        assert_raises(AttributeError,
+                      setattr, node_class(), 'extra_attribute', 42.0)
+
+    for node_class in vector.Input, vector.Node:
+        yield check(node_class)
+
+
+def test_joblib_pickling():
+    """Nodes with array values can be persisted with joblib"""
+    node = vector.Node(name='constant')
+    node._value = np.array([42.0])
+    pickle_buffer = io.BytesIO()
+    joblib.dump(node, pickle_buffer)
+    pickle_buffer.seek(0)
+
+    unpickled_node = joblib.load(pickle_buffer)
+
+    eq_('constant', unpickled_node.name)
+    assert_array_equal(np.array([42.0]), unpickled_node._value)
+
+
+_INPUT_EQUALITY_CASES = (
+    ('unnamed (auto-named) dirty value inputs',
+     Input(name=None, value=DIRTY), Input(name=None, value=DIRTY),
+     False),
+    ('non-matching names',
+     Input(name='a', value=DIRTY), Input(name='b', value=DIRTY),
+     False),
+    ('named vs. unnamed node',
+     Input(name='a', value=DIRTY), Input(name=None, value=DIRTY),
+     False),
+)
 
 
 def test_input_equality():
@@ -269,62 +549,62 @@ def test_input_equality():
         result = a == b
         eq_(expected, result)
 
-    yield check('unnamed (auto-named) dirty value inputs',
-                Input(name=None, value=DIRTY), Input(name=None, value=DIRTY),
-                False)
-    yield check('non-matching names',
-                Input(name='a', value=DIRTY), Input(name='b', value=DIRTY),
-                False)
-    yield check('named vs. unnamed node',
-                Input(name='a', value=DIRTY), Input(name=None, value=DIRTY),
-                False)
+    for case in _INPUT_EQUALITY_CASES:
+        yield check(*case)
 
 
 class VectorNodeVerifyOutputTypeTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # actions have no state, so all tests can share them
+        cls.no_output_type_action = NoOutputTypeAction()
+        cls.none_output_type_action = NoneOutputTypeAction()
+        cls.int_output_type_action = IntOutputTypeAction()
+
     def setUp(self):
         self.input = Input()
 
     def test_disabled_and_no_output_type(self):
-        node = vector.Node(action=NoOutputTypeAction(),
+        node = vector.Node(action=self.no_output_type_action,
                            inputs=vector.Node.inputs(self.input))
         self.input.value = np.array(['42'])
         node._evaluate()
 
     def test_disabled_and_none_output_type(self):
-        node = vector.Node(action=NoneOutputTypeAction(),
+        node = vector.Node(action=self.none_output_type_action,
                            inputs=vector.Node.inputs(self.input))
         self.input.value = np.array(['42'])
         node._evaluate()
 
     def test_disabled_and_correct_output_type(self):
-        node = vector.Node(action=IntOutputTypeAction(),
+        node = vector.Node(action=self.int_output_type_action,
                            inputs=vector.Node.inputs(self.input))
         self.input.value = np.array([42])
         node._evaluate()
 
     def test_disabled_and_wrong_output_type(self):
-        node = vector.Node(action=IntOutputTypeAction(),
+        node = vector.Node(action=self.int_output_type_action,
                            inputs=vector.Node.inputs(self.input))
         self.input.value = np.array(['42'])
         node._evaluate()
 
     def test_enabled_and_no_output_type(self):
         with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
-            node = vector.Node(action=NoOutputTypeAction(),
+            node = vector.Node(action=self.no_output_type_action,
                                inputs=vector.Node.inputs(self.input))
             self.input.value = np.array(['42'])
             node._evaluate()
 
     def test_enabled_and_none_output_type(self):
         with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
-            node = vector.Node(action=NoneOutputTypeAction(),
+            node = vector.Node(action=self.none_output_type_action,
                                inputs=vector.Node.inputs(self.input))
             self.input.value = np.array(['42'])
             node._evaluate()
 
     def test_enabled_and_correct_output_type(self):
         with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
-            node = vector.Node(action=IntOutputTypeAction(),
+            node = vector.Node(action=self.int_output_type_action,
                                inputs=vector.Node.inputs(self.input))
             self.input.value = np.array([42])
             node._evaluate()
@@ -333,7 +613,7 @@ class VectorNodeVerifyOutputTypeTestCase(TestCase):
         with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
             with assert_raises(TypeError) as exc:
                 node = vector.Node(name='node',
-                                   action=IntOutputTypeAction(),
+                                   action=self.int_output_type_action,
                                    inputs=vector.Node.inputs(self.input))
                 self.input.value = np.array(['42'])
                 node._evaluate()
@@ -341,3 +621,131 @@ class VectorNodeVerifyOutputTypeTestCase(TestCase):
                 "The output value type 'string_' for [node]\n"
                 "doesn't match the expected type 'int' for action "
                 '"int_action".', str(exc.exception))
+
+    def test_matching_dtype_remembered(self):
+        with patch('lusmu.core.VERIFY_OUTPUT_TYPES', True):
+            node = vector.Node(action=self.int_output_type_action,
+                               inputs=vector.Node.inputs(self.input))
+            self.input.value = np.array([42])
+            node._evaluate()
+            with patch('lusmu.vector._dtype_matches') as dtype_matches:
+                node._evaluate()
+            self.assertFalse(dtype_matches.called)
+
+    def test_dtype_check_cached(self):
+        with patch('lusmu.vector._DTYPE_MATCHES', {}) as matches:
+            self.assertTrue(vector._dtype_matches(np.dtype(float), float))
+            self.assertFalse(vector._dtype_matches(np.dtype('S2'), int))
+            self.assertEqual({(np.dtype(float), float): True,
+                              (np.dtype('S2'), int): False},
+                             matches)
+
+
+class BatchHomeAutomationTestCase(TestCase):
+    """The home automation example processing batches of samples"""
+
+    def test_home_automation_batch(self):
+        brightness_1 = vector.Input()
+        brightness_2 = vector.Input()
+        brightness_sum = vector.Node(
+            action=lambda *args: np.add.reduce(args),
+            inputs=vector.Node.inputs(brightness_1, brightness_2))
+        brightness_inverse = vector.Node(
+            action=lambda value: 510 - value,
+            inputs=vector.Node.inputs(brightness_sum))
+        lamp_power_changes = []
+        _lamp_power = vector.Node(
+            action=lamp_power_changes.append,
+            inputs=vector.Node.inputs(brightness_inverse),
+            triggered=True)
+
+        vector.update_inputs_get_triggered_batch(
+            [(brightness_1, np.arange(1000)),
+             (brightness_2, range(1000))])
+
+        eq_(1, len(lamp_power_changes))
+        np.testing.assert_array_equal(510 - 2 * np.arange(1000),
+                                      lamp_power_changes[0])
+
+        with patch.object(vector.Input, '_value_eq') as value_eq:
+            vector.update_inputs_get_triggered_batch(
+                [(brightness_1, np.arange(1000)),
+                 (brightness_2, range(1000))],
+                compare=False)
+
+        eq_(0, value_eq.call_count)
+        eq_(2, len(lamp_power_changes))
+
+
+class NumExprActionTestCase(TestCase):
+    """Test case for Nodes with numexpr expression actions"""
+
+    def setUp(self):
+        self.a = Input(value=np.array([1., 2.]))
+        self.b = Input(value=np.array([3., 4.]))
+        self.total = vector.Node(action=vector.NumExprAction('a + b'),
+                                 inputs=vector.Node.inputs(a=self.a,
+                                                           b=self.b))
+        self.scaled = vector.Node(action=vector.NumExprAction('2 * x'),
+                                  inputs=vector.Node.inputs(x=self.total))
+
+    def test_chain_fused(self):
+        """A chain of expressions is evaluated in one numexpr call"""
+        with patch('lusmu.vector.ne.evaluate',
+                   wraps=vector.ne.evaluate) as evaluate:
+            assert_array_equal([8., 12.], self.scaled.value)
+        self.assertEqual(1, evaluate.call_count)
+        self.assertEqual('2 * (v0 + v1)', evaluate.call_args[0][0])
+        self.assertEqual(DIRTY, self.total._value)
+
+    def test_shared_input_not_fused(self):
+        """Nodes with other dependents are evaluated separately"""
+        other = vector.Node(action=vector.NumExprAction('-total'),
+                            inputs=vector.Node.inputs(total=self.total))
+        assert_array_equal([8., 12.], self.scaled.value)
+        assert_array_equal([4., 6.], self.total._value)
+        assert_array_equal([-4., -6.], other.value)
+
+    def test_evaluated_input_not_fused(self):
+        """Input Nodes which have a value aren't recalculated"""
+        assert_array_equal([4., 6.], self.total.value)
+        with patch('lusmu.vector.ne.evaluate',
+                   wraps=vector.ne.evaluate) as evaluate:
+            assert_array_equal([8., 12.], self.scaled.value)
+        self.assertEqual('2 * v0', evaluate.call_args[0][0])
+
+    def test_ufunc_inlined_into_expression(self):
+        """Nodes with elementwise ufunc actions are inlined into expressions"""
+        root = vector.Node(action=np.sqrt, inputs=vector.Node.inputs(self.b))
+        scaled = vector.Node(action=vector.NumExprAction('2 * x'),
+                             inputs=vector.Node.inputs(x=root))
+        with patch('lusmu.vector.ne.evaluate',
+                   wraps=vector.ne.evaluate) as evaluate:
+            assert_array_equal(2 * np.sqrt([3., 4.]), scaled.value)
+        self.assertEqual('2 * (sqrt(v0))', evaluate.call_args[0][0])
+
+    def test_ufunc_chain_fused(self):
+        """A chain of ufunc Nodes is evaluated in one numexpr call"""
+        total = vector.Node(action=np.add,
+                            inputs=vector.Node.inputs(self.a, self.b))
+        negated = vector.Node(action=np.negative,
+                              inputs=vector.Node.inputs(total))
+        with patch('lusmu.vector._NUMEXPR_MIN_SIZE', 0), \
+                patch('lusmu.vector.ne.evaluate',
+                      wraps=vector.ne.evaluate) as evaluate:
+            assert_array_equal([-4., -6.], negated.value)
+        self.assertEqual(1, evaluate.call_count)
+        self.assertEqual('-(v0 + v1)', evaluate.call_args[0][0])
+        self.assertEqual(DIRTY, total._value)
+
+    def test_ufunc_chain_of_series_not_fused(self):
+        """Ufuncs are called one by one for Series to preserve the index"""
+        a = Input(value=pd.Series([1., 2.], index=[10, 20]))
+        total = vector.Node(action=np.add, inputs=vector.Node.inputs(a, a))
+        negated = vector.Node(action=np.negative,
+                              inputs=vector.Node.inputs(total))
+        with patch('lusmu.vector._NUMEXPR_MIN_SIZE', 0), \
+                patch('lusmu.vector.ne.evaluate') as evaluate:
+            result = negated.value
+        self.assertFalse(evaluate.called)
+        self.assertTrue(result.equals(pd.Series([-2., -4.], index=[10, 20])))
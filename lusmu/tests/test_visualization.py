@@ -0,0 +1,190 @@
+"""Test suite for lusmu.visualization
+
+Copyright 2013 Eniram Ltd. See the LICENSE file at the top-level directory of
+this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
+
+"""
+
+import gc
+import subprocess
+from unittest import TestCase
+import weakref
+
+from lusmu.core import Input, Node
+from lusmu.visualization import (collect_nodes,
+                                 format_node_default,
+                                 get_action_name,
+                                 graphviz_lines,
+                                 visualize_graph)
+from mock import patch
+
+
+class CollectNodesTestCase(TestCase):
+    """Test case for collect_nodes()"""
+
+    def test_collect_nodes(self):
+        """Inputs and dependents are collected starting from any Node"""
+        root = Input()
+        branch = Node(inputs=Node.inputs(root))
+        leaf = Node(inputs=Node.inputs(branch))
+        other_root = Input()
+        other_leaf = Node(inputs=Node.inputs(other_root, branch))
+        collected_nodes = set()
+        collect_nodes(collected_nodes, branch)
+        self.assertEqual({root, branch, leaf, other_root, other_leaf},
+                         collected_nodes)
+
+    def test_collect_nodes_huge_number_of_inputs(self):
+        """Nodes with more inputs than the recursion limit can be collected"""
+        inputs = [Input('input{}'.format(index)) for index in range(5000)]
+        node = Node(inputs=Node.inputs(*inputs))
+        collected_nodes = set()
+        collect_nodes(collected_nodes, node)
+        self.assertEqual(set(inputs) | {node}, collected_nodes)
+
+    def test_collect_into_set_subclass(self):
+        """Nodes can be collected into any container with add()"""
+        class NodeSet(set):
+            """Set subclass for testing collection into other containers"""
+
+        root = Input()
+        leaf = Node(inputs=Node.inputs(root))
+        collected_nodes = NodeSet()
+        collect_nodes(collected_nodes, leaf)
+        self.assertEqual({root, leaf}, collected_nodes)
+
+    def test_collect_into_other_container(self):
+        """Nodes can be collected into a container which isn't a set"""
+        class NodeList(list):
+            """List with add() for testing collection into other containers"""
+            add = list.append
+
+        root = Input()
+        leaf = Node(inputs=Node.inputs(root))
+        collected_nodes = NodeList()
+        collect_nodes(collected_nodes, leaf)
+        self.assertEqual([leaf, root], collected_nodes)
+
+
+class GraphvizLinesTestCase(TestCase):
+    """Test case for graphviz_lines()"""
+
+    def test_nodes_in_creation_order(self):
+        """Nodes are listed in creation order and numbered by it"""
+        root = Input('root')
+        leaf = Node('leaf', inputs=Node.inputs(root))
+        lines = list(graphviz_lines([leaf], None,
+                                    lambda node_id, node: [node_id]))
+        self.assertEqual(['digraph gr {',
+                          '  graph [ dpi = 48 ];',
+                          '  rankdir = LR;',
+                          '  { rank = source;',
+                          '    n{};'.format(root._seq_id),
+                          '  }',
+                          'n{}'.format(root._seq_id),
+                          '  n{} -> n{};'.format(root._seq_id, leaf._seq_id),
+                          'n{}'.format(leaf._seq_id),
+                          '}'],
+                         lines)
+
+    def test_cached_rendering(self):
+        """Rendering the same graph again reuses the cached lines"""
+        root = Input('root')
+        leaf = Node('leaf', inputs=Node.inputs(root))
+        with patch('lusmu.visualization.format_node_default',
+                   wraps=format_node_default) as format_node:
+            lines = graphviz_lines([leaf], None, format_node)
+            self.assertEqual(lines,
+                             graphviz_lines([leaf], None, format_node))
+        self.assertEqual(2, format_node.call_count)
+
+    def test_cache_invalidated_by_graph_changes(self):
+        """Connecting and renaming Nodes causes the graph to be re-rendered"""
+        root = Input('root')
+        leaf = Node('leaf', inputs=Node.inputs(root))
+        graphviz_lines([leaf], None, format_node_default)
+        other = Node('other', inputs=Node.inputs(root))
+        self.assertIn('other',
+                      ''.join(graphviz_lines([leaf], None,
+                                             format_node_default)))
+        other.name = 'renamed'
+        self.assertIn('renamed',
+                      ''.join(graphviz_lines([leaf], None,
+                                             format_node_default)))
+
+    def test_custom_formatter_not_cached(self):
+        """Custom formatters may show values, so they aren't cached"""
+        root = Input('root', value=1)
+
+        def format_node(node_id, node):
+            return ['{}={}'.format(node.name, node._value)]
+
+        self.assertIn('root=1', graphviz_lines([root], None, format_node))
+        root.value = 2
+        self.assertIn('root=2', graphviz_lines([root], None, format_node))
+
+    def test_cache_doesnt_keep_nodes_alive(self):
+        """The cached rendering doesn't keep the seed nodes alive"""
+        root = Input('root')
+        graphviz_lines([root], None, format_node_default)
+        root_ref = weakref.ref(root)
+        del root
+        gc.collect()
+        self.assertEqual(None, root_ref())
+
+
+class GetActionNameTestCase(TestCase):
+    """Test case for get_action_name()"""
+
+    def test_name_attribute(self):
+        """The name attribute of an action is preferred"""
+        def action():
+            pass
+        action.name = 'named'
+        self.assertEqual('named', get_action_name(action))
+
+    def test_function_name(self):
+        """Functions are named by their own name"""
+        self.assertEqual('get_action_name',
+                         get_action_name(get_action_name))
+
+    def test_class_name(self):
+        """Other callables are named by their class"""
+        self.assertEqual('NoneType', get_action_name(None))
+
+
+class FormatNodeDefaultTestCase(TestCase):
+    """Test case for format_node_default()"""
+
+    def test_input(self):
+        """Inputs are ovals labeled with their name"""
+        self.assertEqual(['  n1 [label=<<B>root</B>> shape=oval];',
+                          '  edge [color=blue];'],
+                         list(format_node_default('n1', Input('root'))))
+
+    def test_node(self):
+        """Nodes are boxes labeled with their name and action"""
+        def double(value):
+            return 2 * value
+
+        node = Node('node', action=double)
+        self.assertEqual(['  n2 [label=<<B>node</B>'
+                          ' <BR ALIGN="LEFT"/> <BR ALIGN="LEFT"/>'
+                          '<FONT COLOR="#888888">double</FONT>>'
+                          ' shape=box];',
+                          '  edge [color=blue];'],
+                         list(format_node_default('n2', node)))
+
+
+class VisualizeGraphTestCase(TestCase):
+    """Test case for visualize_graph()"""
+
+    def test_source_passed_to_graphviz(self):
+        """The source is passed to Graphviz on its standard input"""
+        root = Input('root')
+        with patch('lusmu.visualization.subprocess.Popen') as popen:
+            source = visualize_graph([root], 'graph.png')
+        popen.assert_called_once_with(['dot', '-Tpng', '-o', 'graph.png'],
+                                      stdin=subprocess.PIPE)
+        popen.return_value.communicate.assert_called_once_with(
+            source.encode('utf-8'))
@@ -5,6 +5,8 @@ this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
 
 """
 
+from functools import wraps
+
 
 def parameterize(func):
     """Decorator for setting test function description based on arguments
@@ -22,12 +24,24 @@ def parameterize(func):
             yield check(2, 2, 4)
 
     """
+    description_template = func.__doc__
+
     def get_test_call_info(*args):
-        """Set test function description and return yieldable tuple"""
-        if func.__doc__:
-            func.description = func.__doc__.format(*args)
+        """Return a yieldable tuple with a described copy of the function
+
+        Each test case gets a function object of its own, so the descriptions
+        of cases don't overwrite each other in the shared test function.
+
+        """
+        @wraps(func)
+        def test_case(*case_args):
+            """Call the test function"""
+            return func(*case_args)
+
+        if description_template:
+            test_case.description = description_template.format(*args)
         else:
-            func.description = func.__doc__
-        return (func,) + args
+            test_case.description = description_template
+        return (test_case,) + args
 
     return get_test_call_info
@@ -14,14 +14,164 @@ this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
 #         mixins have few public methods, that's ok
 
 import logging
+from operator import attrgetter
+import re
 from lusmu.core import (DIRTY,
                         Input as LusmuInput,
                         Node as LusmuNode,
-                        update_inputs)
+                        update_inputs,
+                        update_inputs_get_triggered)
 import numexpr as ne
 import numpy as np
 import pandas as pd
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# ``np.array_equal()`` can consider NaNs equal since numpy 1.19
+_ARRAY_EQUAL_NAN = np.lib.NumpyVersion(np.__version__) >= '1.19.0'
+
+# numexpr evaluates expressions in multithreaded chunks, which only pays off
+# for arrays large enough to amortize its per-call overhead
+_NUMEXPR_MIN_SIZE = 1 << 20
+
+# The NaN-aware comparison for numexpr, see http://stackoverflow.com/a/10821267
+_NAN_EQ_EXPRESSION = '(a==b)|((a!=a)&(b!=b))'
+
+# The comparison compiled once for the array types numexpr supports natively.
+# numexpr calls the float32 type ``float``, and complex128 ``complex``.
+_NAN_EQ_PROGRAMS = {
+    np.dtype(dtype): ne.NumExpr(_NAN_EQ_EXPRESSION,
+                                signature=[('a', numexpr_type),
+                                           ('b', numexpr_type)])
+    for dtype, numexpr_type in [(np.float32, float),
+                                (np.float64, np.float64),
+                                (np.complex128, complex)]}
+
+# Float types the numba compiled comparison supports.  Half precision and
+# non-native byte order arrays fail to compile.
+_NUMBA_FLOAT_DTYPES = frozenset([np.dtype(np.float32), np.dtype(np.float64)])
+
+# Unsigned integer types for viewing floats of each size as bit patterns
+_FLOAT_BITS = {2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+# numexpr templates for numpy ufuncs which operate elementwise.  Nodes with
+# these actions can be fused into numexpr expressions, see ``NumExprAction``.
+_POINTWISE_UFUNCS = {np.add: '{} + {}',
+                     np.subtract: '{} - {}',
+                     np.multiply: '{} * {}',
+                     np.negative: '-{}',
+                     np.absolute: 'abs({})',
+                     np.sqrt: 'sqrt({})',
+                     np.exp: 'exp({})',
+                     np.log: 'log({})',
+                     np.log10: 'log10({})',
+                     np.sin: 'sin({})',
+                     np.cos: 'cos({})',
+                     np.tan: 'tan({})',
+                     np.arctan2: 'arctan2({}, {})'}
+
+# Array types numexpr supports natively
+_NUMEXPR_DTYPES = frozenset(np.dtype(dtype)
+                            for dtype in (np.int32, np.int64,
+                                          np.float32, np.float64,
+                                          np.complex128))
+
+
+if numba:
+    @numba.njit(cache=True)
+    def _eq_nan(a, b):
+        """Compare 1-D float arrays, considering NaNs equal
+
+        Compiled with numba into one loop which stops at the first difference
+        and allocates no temporary arrays.
+
+        """
+        # pylint: disable=C0103
+        #         allow one-letter function arguments
+        if a.shape != b.shape:
+            return False
+        for i in range(a.size):
+            if a[i] != b[i] and not (a[i] != a[i] and b[i] != b[i]):
+                return False
+        return True
+else:
+    _eq_nan = None
+
+
+def _ends_differ(a, b):
+    """Return True if the first or the last elements of arrays differ
+
+    NaNs are considered equal.  The arrays must have the same non-zero size.
+
+    """
+    # pylint: disable=C0103
+    #         allow one-letter function arguments
+    for index in 0, -1:
+        x, y = a.flat[index], b.flat[index]
+        if x != y and not (x != x and y != y):
+            return True
+    return False
+
+
+def _array_eq(a, b):
+    """Return True if arrays are equal, considering NaNs equal
+
+    Arrays of different shapes are never equal.  The shapes are compared
+    first so arrays are never broadcast against each other.  Arrays viewing
+    the same memory in the same way are equal without comparing elements,
+    which is common when values are passed along unchanged.  Only floating
+    point and complex arrays can contain NaNs, so other arrays are compared
+    with a plain ``np.array_equal()``.  Numeric arrays whose first or last
+    elements differ are found unequal without scanning the rest of them,
+    which catches most changed values cheaply.  Contiguous native float32 and
+    float64 arrays of any shape are compared with a numba compiled loop over
+    their flattened views if numba is installed.  Without numba, and for
+    other float types, the bit patterns of contiguous arrays are compared as
+    integers first, since identical bits are always equal.
+    Other float and complex arrays are compared with numexpr if they're
+    huge, and with numpy otherwise.
+
+    """
+    # pylint: disable=C0103
+    #         allow one-letter function arguments
+    if a.shape != b.shape:
+        return False
+    if ((isinstance(a, np.ndarray) and isinstance(b, np.ndarray)
+         and a.dtype == b.dtype and a.strides == b.strides
+         and a.ctypes.data == b.ctypes.data)):
+        # views of the very same memory
+        return True
+    if ((a.size and a.dtype.kind in 'biufc' and b.dtype.kind in 'biufc'
+         and _ends_differ(a, b))):
+        return False
+    if a.dtype.kind not in 'fc' or b.dtype.kind not in 'fc':
+        return np.array_equal(a, b)
+    if a.dtype.kind == 'f' and b.dtype.kind == 'f':
+        a, b = np.asarray(a), np.asarray(b)
+        if a.flags.c_contiguous and b.flags.c_contiguous:
+            if ((_eq_nan is not None
+                 and a.dtype in _NUMBA_FLOAT_DTYPES
+                 and b.dtype in _NUMBA_FLOAT_DTYPES)):
+                # ``ravel()`` of a contiguous array is a view, not a copy
+                return _eq_nan(a.ravel(), b.ravel())
+            bits = _FLOAT_BITS.get(a.dtype.itemsize)
+            if ((a.dtype == b.dtype and bits is not None
+                 and np.array_equal(a.view(bits), b.view(bits)))):
+                # identical bit patterns, including those of NaNs
+                return True
+    if a.size >= _NUMEXPR_MIN_SIZE:
+        program = _NAN_EQ_PROGRAMS.get(a.dtype) if a.dtype == b.dtype else None
+        if program is None:
+            return bool(np.all(ne.evaluate(_NAN_EQ_EXPRESSION)))
+        return bool(np.all(program(a, b)))
+    if _ARRAY_EQUAL_NAN:
+        return np.array_equal(a, b, equal_nan=True)
+    return bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+
 
 def vector_eq(a, b):
     """Return True if vectors are equal, comparing NaNs correctly too
@@ -42,12 +192,13 @@ def vector_eq(a, b):
     if not a_length and not b_length:
         # dtypes might be wrong for empty arrays
         return True
-    # Consider NaNs equal; see http://stackoverflow.com/a/10821267
-    return np.all(ne.evaluate('(a==b)|((a!=a)&(b!=b))'))
+    return _array_eq(np.asarray(a), np.asarray(b))
 
 
 class VectorEquality(object):
     """Mixin for extending Lusmu Inputs and Nodes to work with vector values"""
+    __slots__ = ()
+
     def _value_eq(self, other_value):
         """Replace the equality test of Input/Node values
 
@@ -61,37 +212,142 @@ class VectorEquality(object):
         #         This class will be mixed into ones that have _value
         a = self._value
         b = other_value
+        if a is b:
+            return True
+        if type(a) is not type(b):
+            return False
         try:
-            if type(a) != type(b):
-                return False
             if len(a)==0 and len(b)==0:
                 return True
-            if a.shape != b.shape:
-                return False
-            if not np.all(ne.evaluate('(a==b)|((a!=a)&(b!=b))')):
-                return False
             if hasattr(a, 'index') and hasattr(b, 'index'):
-                # The values are Pandas Series with time indices. Compare time
-                # indices, too.
-                a_ind = VectorEquality()
-                # FIXME: We should support non-number indices as well!
-                a_ind._value = a.index.values.astype(float)
-                return a_ind._value_eq(b.index.values.astype(float))
-            return True
+                # The values are Pandas Series with time indices.  Compare
+                # the underlying arrays, and time indices, too.  Series
+                # derived from each other often share the very same index
+                # object.
+                return (_array_eq(a.values, b.values)
+                        and (a.index is b.index or a.index.equals(b.index)))
+            return _array_eq(a, b)
         except (AttributeError, TypeError):
             # not pandas or numpy objects
-            return (
-                type(self._value) == type(other_value) and
-                self._value == other_value)
+            return a == b
 
 
 class NodePickleMixin(object):
     """Mixin defining the attributes to pickle for all node types"""
-    _state_attributes = 'name', '_dependents', '_value'
+    __slots__ = ()
+
+    _state_attributes = ('name',
+                         '_dependents',
+                         '_value',
+                         '_has_triggered_descendant')
 
     def __getstate__(self):
-        return {key: getattr(self, key)
-                for key in self._state_attributes}
+        return dict(zip(self._state_attributes,
+                        self._get_state_getter()(self)))
+
+    @classmethod
+    def _get_state_getter(cls):
+        """Return a function which gets the values of the state attributes
+
+        Subclasses extend ``_state_attributes``, so the getter is created and
+        attached to each class when its first instance is pickled.
+
+        """
+        getter = cls.__dict__.get('_state_getter')
+        if getter is None:
+            getter = cls._state_getter = attrgetter(*cls._state_attributes)
+        return getter
+
+    def __setstate__(self, state):
+        # Most attributes are in slots, and ``name`` is a property, so they
+        # can't be restored into ``__dict__``.  Pickles from older versions
+        # don't tell whether there are triggered descendants, so assume there
+        # are.
+        self._init_state()
+        self._has_triggered_descendant = True
+        for key, value in self._convert_legacy_state(state).items():
+            setattr(self, key, value)
+
+    def _convert_legacy_state(self, state):
+        """Convert state pickled by older versions to current attributes
+
+        Older versions stored dependents in a set.
+
+        """
+        dependents = state.get('_dependents')
+        if isinstance(dependents, (set, frozenset)):
+            state = dict(state, _dependents=list(dependents))
+        return state
+
+
+# Results of dtype checks by (dtype, output type)
+_DTYPE_MATCHES = {}
+
+# Names of variables in numexpr expressions.  Names followed by an opening
+# parenthesis are function calls.
+_EXPRESSION_VARIABLE_RE = re.compile(r'\b[A-Za-z_]\w*\b(?!\s*\()')
+
+
+def _dtype_matches(dtype, output_type):
+    """Return True if the dtype's scalar type is a subclass of output type
+
+    Results are cached for each pair of dtype and output type, so the class
+    hierarchy is only checked once for each.
+
+    """
+    key = dtype, output_type
+    matches = _DTYPE_MATCHES.get(key)
+    if matches is None:
+        matches = _DTYPE_MATCHES[key] = issubclass(dtype.type, output_type)
+    return matches
+
+
+def _can_fuse_ufuncs(values):
+    """Return True if numexpr should evaluate fused ufuncs for given values
+
+    pandas Series are left to the ufuncs so their index is preserved, and
+    small arrays are faster to process with numpy directly.
+
+    """
+    return (all(type(value) is np.ndarray and value.dtype in _NUMEXPR_DTYPES
+                for value in values)
+            and max(value.size for value in values) >= _NUMEXPR_MIN_SIZE)
+
+
+class NumExprAction(object):
+    """Node action which evaluates a numexpr expression for array inputs
+
+    Variables in the expression are the keyword input names of the Node.
+    When a Node with a ``NumExprAction`` is evaluated, the expressions of
+    dirty untriggered input Nodes which also have a ``NumExprAction`` and
+    no other dependents are inlined into its expression.  The whole chain is
+    then evaluated in one ``numexpr.evaluate()`` call, and the values of
+    those intermediate Nodes are never stored in memory.
+
+    Nodes whose action is an elementwise numpy ufunc like ``np.add`` or
+    ``np.sqrt`` with only positional inputs are inlined the same way.  A
+    chain of such Nodes is also fused into one numexpr call without a
+    ``NumExprAction`` at its end, but only if all the leaf values are plain
+    numpy arrays of types supported by numexpr and large enough to pay off
+    its overhead.  Otherwise the ufuncs are called one Node at a time.
+
+    Example::
+
+        >>> a, b = Input(value=np.arange(3.)), Input(value=np.ones(3))
+        >>> total = Node(action=NumExprAction('a + b'),
+        ...              inputs=Node.inputs(a=a, b=b))
+        >>> scaled = Node(action=NumExprAction('2 * total'),
+        ...               inputs=Node.inputs(total=total))
+        >>> scaled.value
+        array([2., 4., 6.])
+
+    """
+    def __init__(self, expression, name=None):
+        self.expression = expression
+        self.name = name or expression
+
+    def __call__(self, **values):
+        return ne.evaluate(self.expression, local_dict=values)
 
 
 class Input(NodePickleMixin, VectorEquality, LusmuInput):
@@ -100,15 +356,40 @@ class Input(NodePickleMixin, VectorEquality, LusmuInput):
     The value of the input node is always set dirty when unpickling.
 
     """
+    __slots__ = ('_last_timestamp',
+                 '_last_timestamp_ns',
+                 '_last_timestamp_tz')
+
     _state_attributes = NodePickleMixin._state_attributes + ('last_timestamp',)
 
     def __init__(self, name=None, value=DIRTY):
         super(Input, self).__init__(name=name, value=value)
-        self.last_timestamp = self._get_max_timestamp(value)
+        self.last_timestamp = None
+        self._update_last_timestamp(value)
 
-    @staticmethod
-    def _get_max_timestamp(value):
-        """Return the latest timestamp in the Series
+    @property
+    def last_timestamp(self):
+        """The latest timestamp processed
+
+        For datetime indices only the int64 nanoseconds since the epoch and
+        the time zone are stored when a value is set, and the
+        ``pandas.Timestamp`` is only created when this property is read.
+
+        """
+        if ((self._last_timestamp is None
+             and self._last_timestamp_ns is not None)):
+            self._last_timestamp = pd.Timestamp(self._last_timestamp_ns,
+                                                tz=self._last_timestamp_tz)
+        return self._last_timestamp
+
+    @last_timestamp.setter
+    def last_timestamp(self, last_timestamp):
+        self._last_timestamp = last_timestamp
+        self._last_timestamp_ns = None
+        self._last_timestamp_tz = None
+
+    def _update_last_timestamp(self, value):
+        """Keep track of the latest timestamp in the index of a Series
 
         Arguments
         ---------
@@ -116,14 +397,20 @@ class Input(NodePickleMixin, VectorEquality, LusmuInput):
 
         """
         if isinstance(value, pd.Series) and len(value):
-            return value.index[-1]
-
-    def _set_value(self, value, get_triggered=True):
+            index = value.index
+            if isinstance(index, pd.DatetimeIndex):
+                self._last_timestamp = None
+                self._last_timestamp_ns = index.asi8[-1]
+                self._last_timestamp_tz = index.tz
+            else:
+                self.last_timestamp = index[-1]
+
+    def _set_value(self, value, get_triggered=True, compare=True):
         """Keep track of latest timestamp processed"""
-        new_last_timestamp = self._get_max_timestamp(value)
-        if new_last_timestamp:
-            self.last_timestamp = new_last_timestamp
-        return super(Input, self)._set_value(value, get_triggered=get_triggered)
+        self._update_last_timestamp(value)
+        return super(Input, self)._set_value(value,
+                                             get_triggered=get_triggered,
+                                             compare=compare)
 
     def __eq__(self, other):
         """Equality comparison provided for unit test convenience"""
@@ -132,11 +419,36 @@ class Input(NodePickleMixin, VectorEquality, LusmuInput):
 
 class Node(NodePickleMixin, VectorEquality, LusmuNode):
     """Vector compatible Lusmu Node"""
+    __slots__ = ()
+
     _state_attributes = (NodePickleMixin._state_attributes +
                          ('_action',
-                          'triggered',
-                          '_positional_inputs',
-                          '_keyword_inputs'))
+                          '_triggered',
+                          '_inputs',
+                          '_keyword_names'))
+
+    def _convert_legacy_state(self, state):
+        """Convert state pickled by older versions to current attributes
+
+        Older versions stored positional and keyword inputs separately, and
+        ``triggered`` wasn't a property.  Inputs are assigned directly instead
+        of through ``set_inputs()``, since in a pickled graph an input may not
+        have been restored yet when its dependent is.
+
+        """
+        state = super(Node, self)._convert_legacy_state(state)
+        if '_positional_inputs' in state or '_keyword_inputs' in state:
+            state = dict(state)
+            keyword_inputs = state.pop('_keyword_inputs', None) or {}
+            keyword_names = tuple(keyword_inputs)
+            state['_keyword_names'] = keyword_names
+            state['_inputs'] = (
+                tuple(state.pop('_positional_inputs', ()))
+                + tuple(keyword_inputs[name] for name in keyword_names))
+        if 'triggered' in state:
+            state = dict(state)
+            state['_triggered'] = state.pop('triggered')
+        return state
 
     def _verify_output_type(self, value):
         """Assert that the given value matches the action's output type
@@ -145,25 +457,167 @@ class Node(NodePickleMixin, VectorEquality, LusmuNode):
 
         """
         if hasattr(value, 'dtype'):
-            if not issubclass(value.dtype.type, self._action.output_type):
-                raise TypeError(
-                    "The output value type {value.dtype.type.__name__!r} "
-                    "for [{self.name}]\n"
-                    "doesn't match the expected type "
-                    "{self._action.output_type.__name__!r} for action "
-                    '"{self._action.name}".'
-                    .format(value=value, self=self))
+            if not _dtype_matches(value.dtype, self._action.output_type):
+                raise self._output_type_error(value.dtype.type.__name__)
         else:
             super(Node, self)._verify_output_type(value)
 
+    def _make_output_type_check(self):
+        """Return a function for verifying output types of the action
+
+        The function remembers the dtypes which matched the action's output
+        type, so verifying a value of the same dtype again is a single set
+        lookup.
+
+        """
+        output_type = self._action.output_type
+        verify_other = super(Node, self)._verify_output_type
+        matching_dtypes = set()
+
+        def check(value):
+            dtype = getattr(value, 'dtype', None)
+            if dtype is None:
+                verify_other(value)
+            elif dtype not in matching_dtypes:
+                if not _dtype_matches(dtype, output_type):
+                    raise self._output_type_error(dtype.type.__name__)
+                matching_dtypes.add(dtype)
+
+        return check
+
     def _evaluate(self):
         """Log a message when evaluating a node"""
         # pylint: disable=E1101
         #         self.name comes from lusmu
         logger = logging.getLogger(__name__)
         logger.debug('[%s]._evaluate()', self.name)
-        return super(Node, self)._evaluate()
+        if isinstance(self._action, NumExprAction):
+            local_dict = {}
+            value = ne.evaluate(self._fuse_expression(local_dict),
+                                local_dict=local_dict)
+        elif self._has_fusable_inputs():
+            local_dict = {}
+            expression = self._fuse_expression(local_dict)
+            if not _can_fuse_ufuncs(list(local_dict.values())):
+                return super(Node, self)._evaluate()
+            value = ne.evaluate(expression, local_dict=local_dict)
+        elif getattr(self._action, 'unwrap_series', False):
+            value = self._evaluate_unwrapped()
+        else:
+            return super(Node, self)._evaluate()
+        check = self._output_type_check or self._resolve_output_type_check()
+        check(value)
+        return value
+
+    def _evaluate_unwrapped(self):
+        """Call the action with the arrays underlying pandas Series inputs
+
+        Used for actions with a true ``unwrap_series`` attribute, like
+        numba-compiled functions which only accept numpy arrays.  A
+        one-dimensional result of the same length as the first Series input
+        is wrapped into a Series with the index of that input.
+
+        """
+        values = [node.get_value() for node in self._inputs]
+        index = next((value.index for value in values
+                      if isinstance(value, pd.Series)),
+                     None)
+        arrays = [value.values if isinstance(value, pd.Series) else value
+                  for value in values]
+        positional_count = len(arrays) - len(self._keyword_names)
+        result = self._action(*arrays[:positional_count],
+                              **dict(zip(self._keyword_names,
+                                         arrays[positional_count:])))
+        if ((index is not None
+             and np.ndim(result) == 1 and len(result) == len(index))):
+            return pd.Series(result, index=index)
+        return result
+
+    def _fuse_expression(self, local_dict):
+        """Return the expression of the action with fusable inputs inlined
+
+        Values of the other inputs are added to ``local_dict`` with unique
+        variable names.  See ``NumExprAction``.
+
+        """
+        if not isinstance(self._action, NumExprAction):
+            return self._get_ufunc_template().format(
+                *[self._fuse_input(node, local_dict) for node in self._inputs])
+        keyword_inputs = self._inputs[len(self._inputs) -
+                                      len(self._keyword_names):]
+        variables = {name: self._fuse_input(node, local_dict)
+                     for name, node in zip(self._keyword_names,
+                                           keyword_inputs)}
+        return _EXPRESSION_VARIABLE_RE.sub(
+            lambda match: variables.get(match.group(0), match.group(0)),
+            self._action.expression)
+
+    def _fuse_input(self, node, local_dict):
+        """Return the inlined expression or a variable name for an input
+
+        The value of an input which can't be inlined is added to
+        ``local_dict``.
+
+        """
+        if isinstance(node, Node) and node._is_fusable_into(self):
+            return '({})'.format(node._fuse_expression(local_dict))
+        variable = 'v{}'.format(len(local_dict))
+        local_dict[variable] = node.get_value()
+        return variable
+
+    def _get_ufunc_template(self):
+        """Return the numexpr template for an elementwise ufunc action
+
+        Returns None unless the action is one of the known elementwise numpy
+        ufuncs and the Node has one positional input for each of its
+        arguments.
+
+        """
+        action = self._action
+        if ((not isinstance(action, np.ufunc)
+             or self._keyword_names
+             or len(self._inputs) != action.nin)):
+            return None
+        return _POINTWISE_UFUNCS.get(action)
+
+    def _has_fusable_inputs(self):
+        """Return True if inputs can be inlined into this ufunc Node"""
+        return (self._get_ufunc_template() is not None
+                and any(isinstance(node, Node) and node._is_fusable_into(self)
+                        for node in self._inputs))
+
+    def _is_fusable_into(self, dependent):
+        """Return True if this Node can be inlined into its only dependent"""
+        return ((isinstance(self._action, NumExprAction)
+                 or self._get_ufunc_template() is not None)
+                and self._value is DIRTY
+                and not self._triggered
+                and len(self._dependents) == 1
+                and self._dependents[0] is dependent)
 
     def __eq__(self, other):
         """Equality comparison provided for unit test convenience"""
-        return self.__dict__ == other.__dict__
+        return self.__getstate__() == other.__getstate__()
+
+
+def update_inputs_get_triggered_batch(inputs_and_values, compare=True):
+    """Update Inputs with batches of samples and return triggered Nodes
+
+    Each value is a sequence of samples for an Input.  Values which aren't
+    already numpy arrays or pandas Series are converted into arrays, so
+    dependent Nodes with array compatible actions calculate results for the
+    whole batch in one evaluation instead of one graph update per sample.
+
+    Arguments
+    ---------
+    inputs_and_values: iterable of (Input, sequence) tuples
+
+    compare: bool
+                If False, batches aren't compared to the previous values of
+                the Inputs.  See ``lusmu.core.update_inputs_iter()``.
+
+    """
+    return update_inputs_get_triggered(
+        ((node, values if hasattr(values, 'dtype') else np.asarray(values))
+         for node, values in inputs_and_values),
+        compare=compare)
@@ -14,47 +14,61 @@ from __future__ import print_function, unicode_literals
 import re
 from textwrap import dedent
 
-from lusmu.core import Input, Node
+from lusmu.core import _RENDER_VERSION, Input, Node
 import subprocess
+import weakref
+
+
+# Source lines of the most recent rendering with the default node filter and
+# formatter, the render version they were rendered for and weak references to
+# the seed nodes
+_GRAPHVIZ_LINES = [None, (), ()]
 
 
 def collect_nodes(collected_nodes, *args):
     """Collect all nodes belonging to the same graph
 
-    Walks dependent Nodes and inputs recursively.
+    Walks dependent Nodes and inputs iteratively, so graphs of any size can
+    be collected without hitting the recursion limit.
+
+    If the ``lusmu._traversal`` extension module has been compiled with
+    Cython, its identical implementation of this function is used instead.
 
     """
-    if not args:
-        return
-    node = args[0]
-    rest = args[1:]
-    collect_nodes(collected_nodes, *rest)
-    if node in collected_nodes:
-        return
-    collected_nodes.add(node)
-    collect_nodes(collected_nodes, *node._dependents)
-    if isinstance(node, Node):
-        collect_nodes(collected_nodes, *node._iterate_inputs())
+    stack = list(args)
+    while stack:
+        node = stack.pop()
+        if node in collected_nodes:
+            continue
+        collected_nodes.add(node)
+        stack.extend(node._dependents)
+        if isinstance(node, Node):
+            stack.extend(node._iterate_inputs())
+
+
+try:
+    from lusmu._traversal import collect_nodes
+except ImportError:
+    pass
 
 
 def get_action_name(action):
     """Try to return a good representation of the name of an action callable"""
-    if hasattr(action, 'name'):
-        return action.name
-    if hasattr(action, '__name__'):
-        return action.__name__
-    if hasattr(action, 'func_name'):
-        return action.func_name
-    return action.__class__.__name__
+    return (getattr(action, 'name', None)
+            or getattr(action, '__name__', None)
+            or getattr(action, 'func_name', None)
+            or action.__class__.__name__)
 
 
 def format_node_default(node_id, node):
-    shape = 'oval' if isinstance(node, Input) else 'box'
-    action = ('{br}{br}<FONT COLOR="#888888">{action}</FONT>'
-              .format(br=' <BR ALIGN="LEFT"/>',
-                      action=get_action_name(node._action))
-              if isinstance(node, Node)
-              else '')
+    if isinstance(node, Node):
+        shape = 'box'
+        action = ('{br}{br}<FONT COLOR="#888888">{action}</FONT>'
+                  .format(br=' <BR ALIGN="LEFT"/>',
+                          action=get_action_name(node._action)))
+    else:
+        shape = 'oval'
+        action = ''
     yield ('  {node_id} '
            '[label=<<B>{name}</B>'
            '{action}>'
@@ -66,44 +80,89 @@ def format_node_default(node_id, node):
     yield '  edge [color=blue];'
 
 
+def _get_seq_id(node):
+    """Return the creation order sequence number of a Node or Input"""
+    return node._seq_id
+
+
+def _include_all_nodes(node):
+    """Default node filter for ``visualize_graph()``"""
+    return True
+
+
+def _is_cached_rendering(nodes):
+    """Return True if the cached lines were rendered for the given nodes
+
+    Seed nodes are compared by identity, since subclasses may define
+    value-based ``__eq__``.
+
+    """
+    version, node_refs, _lines = _GRAPHVIZ_LINES
+    return (version == _RENDER_VERSION[0]
+            and len(nodes) == len(node_refs)
+            and all(node_ref() is node
+                    for node, node_ref in zip(nodes, node_refs)))
+
+
 def graphviz_lines(nodes, node_filter, format_node):
-    """Generate source lines for a Graphviz graph definition"""
+    """Return source lines for a Graphviz graph definition as a list
+
+    The lines are collected in one list, which the caller can join into the
+    graph source in a single operation.
+
+    The lines of the most recent rendering with the default node filter and
+    formatter are cached.  Rendering the same nodes again that way returns a
+    copy of the cached lines as long as no Nodes have been connected,
+    disconnected or renamed in between.  The default formatter only shows
+    names and actions, which can't change without bumping the render version.
+
+    """
+    nodes = tuple(nodes)
+    cacheable = (format_node is format_node_default
+                 and node_filter in (None, _include_all_nodes))
+    if cacheable and _is_cached_rendering(nodes):
+        return list(_GRAPHVIZ_LINES[2])
     all_nodes = set()
     collect_nodes(all_nodes, *nodes)
     if node_filter:
-        all_nodes = [n for n in all_nodes if node_filter(n)]
-    all_nodes = sorted(all_nodes, key=id)
-    input_nodes = [n for n in all_nodes if isinstance(n, Input)]
-
-    yield 'digraph gr {'
-    yield '  graph [ dpi = 48 ];'
-    yield '  rankdir = LR;'
-    yield '  { rank = source;'
-    for node in input_nodes:
-        yield '    n{};'.format(id(node))
-    yield '  }'
-    for node in all_nodes:
-        for line in format_node('n{}'.format(id(node)), node):
-            yield line
-        for other in node._dependents:
-            if other in all_nodes:
-                yield ('  n{node} -> n{other};'
-                       .format(node=id(node), other=id(other)))
-    yield '}'
+        all_nodes = set(n for n in all_nodes if node_filter(n))
+    sorted_nodes = sorted(all_nodes, key=_get_seq_id)
+
+    lines = ['digraph gr {',
+             '  graph [ dpi = 48 ];',
+             '  rankdir = LR;',
+             '  { rank = source;']
+    lines.extend('    n{};'.format(node._seq_id)
+                 for node in sorted_nodes
+                 if isinstance(node, Input))
+    lines.append('  }')
+    for node in sorted_nodes:
+        lines.extend(format_node('n{}'.format(node._seq_id), node))
+        lines.extend('  n{node} -> n{other};'.format(node=node._seq_id,
+                                                       other=other._seq_id)
+                     for other in node._dependents
+                     if other in all_nodes)
+    lines.append('}')
+    if cacheable:
+        _GRAPHVIZ_LINES[:] = (_RENDER_VERSION[0],
+                              [weakref.ref(node) for node in nodes],
+                              lines)
+        return list(lines)
+    return lines
 
 
 def visualize_graph(nodes, filename,
-                    node_filter=lambda node: True,
+                    node_filter=_include_all_nodes,
                     format_node=format_node_default):
     """Saves a visualization of given nodes in an image file"""
     image_format = filename.split('.')[-1].lower()
+    source = '\n'.join(graphviz_lines(nodes,
+                                      node_filter,
+                                      format_node))
     graphviz = subprocess.Popen(['dot',
                                  '-T{}'.format(image_format),
                                  '-o', filename],
                                 stdin=subprocess.PIPE)
-    source = '\n'.join(graphviz_lines(nodes,
-                                      node_filter,
-                                      format_node))
     graphviz.communicate(source.encode('utf-8'))
 
     # Add some CSS to SVG images
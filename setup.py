@@ -8,6 +8,15 @@ this distribution and at https://github.com/akaihola/lusmu/blob/master/LICENSE
 import os
 from setuptools import setup
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # Without Cython, lusmu.core and lusmu.visualization use their pure
+    # Python graph traversal
+    EXT_MODULES = []
+else:
+    EXT_MODULES = cythonize('lusmu/_traversal.pyx')
+
 
 here = os.path.abspath(os.path.dirname(__file__))
 with open(os.path.join(here, 'README.rst')) as f:
@@ -17,6 +26,7 @@ with open(os.path.join(here, 'README.rst')) as f:
 setup(name='lusmu',
       version='0.2.4.dev',
       packages=['lusmu'],
+      ext_modules=EXT_MODULES,
       author='Antti Kaihola',
       author_email='antti.kaihola@eniram.fi',
       license='BSD',